@@ -1,28 +1,121 @@
-from flask import Flask, render_template, request, session, redirect, url_for
-from flask_session import Session
-from cs50 import SQL
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, session, redirect, url_for
 from functools import wraps
-from matplotlib.figure import Figure
-import base64
-from io import BytesIO
+import csv
 import datetime
+import hashlib
+import io
+import json
+import math
+import os
+import threading
+import zlib
+
+from assets import Assets
+from charts import BAR_STYLES, ChartCache, bar_chart, goals_chart, prewarm
+from cohort import histogram, histograms, percentile_ranks, rebuild_population
+from database import Database
+from hashing import DEFAULT_METHOD, HasherBusy, PasswordHasher
+from instrumentation import Instrumentation
+from migrations import migrate
+from queries import (ACTIVITIES, RANGES, activity_history, activity_range, activity_window, bump_data_version,
+                     ensure_stats, last_dates, rebuild_rollups, rebuild_stats, refresh_goal_stats, save_activities,
+                     save_activity, user_stats)
+from recommendations import rebuild_recommendations, recommendations, refresh_recommendations
+from sessions import configure_sessions, regenerate_session
 
 # Modeling after finance pset
 
 # Configure application
 app = Flask(__name__)
 
+# DOWN_TIME_ENV=production stops templates being reloaded (and checked for changes on every render),
+# compiles them all at startup and serves static files from static/dist (run build_static.py first)
+app.config["DOWN_TIME_ENV"] = os.environ.get("DOWN_TIME_ENV", "development")
+production = app.config["DOWN_TIME_ENV"] == "production"
+
 # Ensure templates are auto-reloaded
-app.config["TEMPLATES_AUTO_RELOAD"] = True
+app.config["TEMPLATES_AUTO_RELOAD"] = not production
 
-# Configure session to use filesystem (instead of signed cookies)
+# Configure sessions: "sqlite" (server-side, the default), "cookie" (signed cookies, needs SECRET_KEY)
+# or "filesystem" (Flask-Session's flask_session/ directory)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "sqlite")
+app.config["SESSION_DB"] = os.environ.get("SESSION_DB", "sessions.db")
+app.config["SESSION_TTL"] = int(os.environ.get("SESSION_TTL", 86400))
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+configure_sessions(app)
+
+# Configure the chart cache (set CHART_CACHE_DIR to keep rendered charts across restarts,
+# at most CHART_CACHE_DISK_SIZE of them per user)
+app.config["CHART_CACHE_SIZE"] = int(os.environ.get("CHART_CACHE_SIZE", 256))
+app.config["CHART_CACHE_DIR"] = os.environ.get("CHART_CACHE_DIR")
+app.config["CHART_CACHE_DISK_SIZE"] = int(os.environ.get("CHART_CACHE_DISK_SIZE", 64))
+chart_cache = ChartCache(app.config["CHART_CACHE_SIZE"], app.config["CHART_CACHE_DIR"], app.config["CHART_CACHE_DISK_SIZE"])
+
+# Draw charts with matplotlib on the server ("server") or in the browser from /api/series ("client")
+app.config["CHART_MODE"] = os.environ.get("CHART_MODE", "server")
+
+# The browser draws them with Chart.js, served from static/ like the app's own scripts (python vendor.py fetches it)
+if app.config["CHART_MODE"] == "client" and not os.path.exists(os.path.join(app.static_folder, "chart.umd.min.js")):
+    raise RuntimeError("CHART_MODE=client requires static/chart.umd.min.js: run python vendor.py")
+
+# matplotlib is only loaded when the first chart is drawn; CHART_PREWARM=1 loads it in the background at startup
+app.config["CHART_PREWARM"] = os.environ.get("CHART_PREWARM", "0") == "1"
+if app.config["CHART_PREWARM"] and app.config["CHART_MODE"] == "server":
+    threading.Thread(target=prewarm, daemon=True).start()
+
+# Hash passwords in a process pool: HASH_WORKERS processes, at most HASH_QUEUE hashes waiting
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+app.config["HASH_WORKERS"] = int(os.environ.get("HASH_WORKERS", 2))
+app.config["HASH_QUEUE"] = int(os.environ.get("HASH_QUEUE", 8))
+hasher = PasswordHasher(app.config["PASSWORD_HASH_METHOD"], 8, app.config["HASH_WORKERS"], app.config["HASH_QUEUE"])
+
+# Largest request body accepted (activity imports are uploaded as files)
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+
+# Windows (in days) the analytics history can be limited to, and how many entries to show per page
+HISTORY_WINDOWS = {"30": 30, "90": 90, "365": 365, "all": None}
+HISTORY_PAGE = 50
+
+# Configure the SQLite database (one WAL-mode connection per thread)
+app.config["DATABASE"] = os.environ.get("DATABASE", "data.db")
+db = Database(app.config["DATABASE"])
+
+# Bring the database schema up to date before serving anything
+migrate(db)
+
+# Record queries, SQL time, chart and template time per request (Server-Timing headers and /metrics)
+app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", 100))
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "1") == "1"
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+Instrumentation(app, db, chart_cache, app.config["SLOW_QUERY_MS"], app.config["SERVER_TIMING"], app.config["METRICS_TOKEN"])
+
+if production:
+    Assets(app)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+@app.cli.command("rebuild-summaries")
+def rebuild_summaries():
+    """Recomputes user_stats and the weekly/monthly rollups from the activity tables"""
+
+    rebuild_stats(db)
+    rebuild_rollups(db)
+
+
+@app.cli.command("population-stats")
+def population_stats():
+    """Recomputes the percentiles and histograms of every user's averages shown on the analytics page"""
+
+    rebuild_population(db)
+
+
+@app.cli.command("refresh-recommendations")
+def refresh_all_recommendations():
+    """Recomputes everyone's recommendations (run daily so rolling averages keep up with the date)"""
+
+    rebuild_recommendations(db)
 
-# Configure CS50 Library to use SQLite database
-db = SQL("sqlite:///data.db")
 
 def login_required(f):
     """
@@ -38,13 +131,97 @@ def login_required(f):
     return decorated_function
 
 
+def changed(user_id):
+    """Drops anything cached from a user's data after they change it"""
+
+    chart_cache.invalidate(user_id)
+    bump_data_version(db, user_id)
+
+
+def conditional(f):
+    """
+    Decorate GET routes whose response depends only on the user's data, the
+    URL and the day, so browsers can revalidate them with If-None-Match or
+    If-Modified-Since and get a 304 without the page being rebuilt.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != "GET" or g.user is None:
+            return f(*args, **kwargs)
+
+        # pages show the last N days, so they also change at midnight
+        today = datetime.date.today()
+        midnight = datetime.datetime.combine(today, datetime.time()).astimezone(datetime.timezone.utc)
+        modified = max(datetime.datetime.fromtimestamp(g.user["data_modified"], datetime.timezone.utc), midnight)
+
+        etag = hashlib.sha1(repr((session["user_id"], g.user["data_version"], str(today), request.full_path,
+                                  app.config["CHART_MODE"], g.user["theme"],
+                                  "image/webp" in request.headers.get("Accept", ""))).encode()).hexdigest()
+        headers = {"Cache-Control": "private, no-cache", "Vary": "Cookie"}
+
+        # If-Modified-Since is only looked at when the browser didn't send an ETag
+        if request.if_none_match:
+            fresh = request.if_none_match.contains(etag)
+        else:
+            fresh = request.if_modified_since is not None and modified.replace(microsecond=0) <= request.if_modified_since
+        if fresh:
+            response = Response(status=304, headers=headers)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.headers.update(headers)
+        response.set_etag(etag)
+        response.last_modified = modified
+        return response
+    return decorated_function
+
+
+@app.errorhandler(HasherBusy)
+def busy(e):
+    """Turns logins away while the password hashing pool is saturated"""
+
+    return render_template("error.html", error="too many logins right now, try again in a moment!"), 503, {"Retry-After": "5"}
+
+
+# Columns of the user's row kept in g.user (and cached in the session)
+USER_COLUMNS = ["id", "username", "name", "theme", "data_version", "data_modified"]
+
+
+@app.before_request
+def load_user():
+    """Loads the logged in user's row once per request into g.user"""
+
+    g.user = None
+    if session.get("user_id") is None:
+        return
+
+    # The row is cached in the session along with the user's data version, which every change
+    # bumps, so a change made from another device (a new theme or username) is picked up too
+    rows = db.execute("SELECT data_version FROM users WHERE id = ?", session["user_id"])
+    if len(rows) != 1:
+        session.clear()
+        return
+
+    user = session.get("user")
+    if user is None or user.get("data_version") != rows[0]["data_version"]:
+        rows = db.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = ?", session["user_id"])
+        if len(rows) != 1:
+            session.clear()
+            return
+        user = rows[0]
+        session["user"] = user
+
+    g.user = user
+
+
 @app.context_processor
 def remember_color():
     """Remember user's color scheme"""
 
     # set the color equal to the user's chosen color scheme
-    if session.get("user_id") is not None:
-        color = db.execute("SELECT theme FROM users WHERE id = ?", session["user_id"])[0]["theme"]
+    if g.get("user") is not None:
+        color = g.user["theme"]
     
     # Use light theme if no user is logged in 
     else:
@@ -57,8 +234,8 @@ def index():
     """Displays the home page"""
 
     # show the user's name if they are logged in
-    if session.get("user_id") is not None:
-        name = ", " + db.execute("SELECT name FROM users WHERE id = ?", session["user_id"])[0]["name"]
+    if g.user is not None:
+        name = ", " + g.user["name"]
     else:
         name = ""
     
@@ -91,11 +268,21 @@ def login():
         rows = db.execute("SELECT * FROM users WHERE username = ?", username)
 
         # Ensure username exists and password is correct
-        if len(rows) != 1 or not check_password_hash(rows[0]["hash"], password):
+        if len(rows) != 1 or not hasher.check(rows[0]["hash"], password):
             return render_template("error.html", error="invalid login!")
 
+        # Upgrade the stored hash if the configured work factor has changed since it was made.
+        # That's best effort: when the hashing pool is busy the login still goes ahead, and it's retried next time
+        if hasher.needs_rehash(rows[0]["hash"]):
+            try:
+                db.execute("UPDATE users SET hash = ? WHERE id = ?", hasher.hash(password), rows[0]["id"])
+            except HasherBusy:
+                pass
+
         # Remember which user has logged in
         session["user_id"] = rows[0]["id"]
+        session["user"] = {key: rows[0][key] for key in USER_COLUMNS}
+        regenerate_session(app, session)
 
         # Redirect user to home page
         return redirect("/")
@@ -145,11 +332,16 @@ def register():
             return render_template("error.html", error="invalid color theme")
 
         # Insert user into the users table
-        hash = generate_password_hash(password, method='pbkdf2:sha256', salt_length=8)
-        new_id = db.execute("INSERT INTO users (username, hash, name, theme) VALUES(?, ?, ?, ?)", username, hash, name, theme)
+        hash = hasher.hash(password)
+        with db.transaction():
+            new_id = db.execute("INSERT INTO users (username, hash, name, theme) VALUES(?, ?, ?, ?)", username, hash, name, theme)
+            ensure_stats(db, new_id)
 
         # Log user in
         session["user_id"] = new_id
+        session["user"] = {"id": new_id, "username": username, "name": name, "theme": theme,
+                           "data_version": 0, "data_modified": 0}
+        regenerate_session(app, session)
         return redirect("/")
 
     # If user reached route using GET method send them to the register page
@@ -170,118 +362,74 @@ def logout():
 
 @app.route("/activities")
 @login_required
+@conditional
 def activities():
     """Displays activities"""
 
-    # getting the dates of the last 7 days
-    today = datetime.datetime.now()
-    dates = []
+    # the range to graph: the last 7 or 30 days, 12 weeks or 12 months
+    span = request.args.get("range", "7d")
+    if span not in RANGES:
+        return render_template("error.html", error="invalid range")
 
-    for i in range(7):
-        delta = datetime.timedelta(days=(6-i))
-        rawdate = str(today - delta)[:10]
-        dates.append(rawdate)
+    # In client mode the browser draws the graphs from /api/series, so there's nothing to query
+    if app.config["CHART_MODE"] == "client":
+        return render_template("activities.html", chart_mode="client", span=span)
 
-    # Generating the sleep graph
-    sleep_amounts = []
+    # Reading the whole range for all four activities in one query
+    labels, amounts, title = activity_range(db, session["user_id"], span)
 
-    for date in dates:
-        amount = db.execute("SELECT AVG(amount) AS amount FROM sleep WHERE user_id = ? AND date = ?", session["user_id"], date)[0]['amount']
-        if amount == None:
-            amount = 0
-
-        sleep_amounts.append(amount)
-
-    fig = Figure()
-    ax = fig.subplots()
-    ax.bar(dates, sleep_amounts, color = "purple")
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Hours')
-    ax.set_title("Timeline: Last 7 Days")
-    fig.autofmt_xdate()
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    sleep = base64.b64encode(buf.getbuffer()).decode("ascii")
-
-    # generating water graph
-    water_amounts = []
-
-    for date in dates:
-        amount = db.execute("SELECT AVG(amount) AS amount FROM water WHERE user_id = ? AND date = ?", session["user_id"], date)[0]['amount']
-        if amount == None:
-            amount = 0
-
-        water_amounts.append(amount)
-
-    fig = Figure()
-    ax = fig.subplots()
-    ax.bar(dates, water_amounts)
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Liters')
-    ax.set_title("Timeline: Last 7 Days")
-    fig.autofmt_xdate()
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    water = base64.b64encode(buf.getbuffer()).decode("ascii")
-
-    # generating exercise graph
-    exercise_amounts = []
-
-    for date in dates:
-        amount = db.execute("SELECT AVG(amount) AS amount FROM exercise WHERE user_id = ? AND date = ?", session["user_id"], date)[0]['amount']
-        if amount == None:
-            amount = 0
-
-        exercise_amounts.append(amount)
-
-    fig = Figure()
-    ax = fig.subplots()
-    ax.bar(dates, exercise_amounts, color='red')
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Minutes')
-    ax.set_title("Timeline: Last 7 Days")
-    fig.autofmt_xdate()
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    exercise = base64.b64encode(buf.getbuffer()).decode("ascii")
-
-    # generating relaxation graph
-    relax_amounts = []
-
-    for date in dates:
-        amount = db.execute("SELECT AVG(amount) AS amount FROM relaxation WHERE user_id = ? AND date = ?", session["user_id"], date)[0]['amount']
-        if amount == None:
-            amount = 0
+    # Generating the graphs (only re-rendered when the range's data changes)
+    theme = g.user["theme"]
+    window = (span, labels[0], labels[-1])
+    graphs = {}
 
-        relax_amounts.append(amount)
-
-    fig = Figure()
-    ax = fig.subplots()
-    ax.bar(dates, relax_amounts, color='green')
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Minutes')
-    ax.set_title("Timeline: Last 7 Days")
-    fig.autofmt_xdate()
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    relax = base64.b64encode(buf.getbuffer()).decode("ascii")
+    for metric in ACTIVITIES:
+        graphs[metric] = chart_cache.chart(session["user_id"], metric, window, theme, amounts[metric],
+                                           lambda metric=metric: bar_chart(metric, labels, amounts[metric], title))
 
     # render the activities template
-    return render_template("activities.html", sleep=sleep, water=water, exercise=exercise, relax=relax)
+    return render_template("activities.html", chart_mode="server", span=span, sleep=graphs["sleep"],
+                           water=graphs["water"], exercise=graphs["exercise"], relax=graphs["relaxation"])
 
 
-@app.route("/sleep", methods=["POST"])
+@app.route("/api/series/<metric>")
 @login_required
-def sleep():
-    """Adds data into the sleep table"""
+@conditional
+def series(metric):
+    """Returns the data behind a graph as JSON so the browser can draw it"""
+
+    # Goals pie chart
+    if metric == "goals":
+        stats = user_stats(db, session["user_id"])
+        return jsonify(metric=metric, labels=["Complete", "Incomplete"],
+                       sizes=[stats["goals_current_complete"], stats["goals_current_incomplete"]])
+
+    if metric not in ACTIVITIES:
+        return jsonify(error="unknown metric"), 404
+
+    # either one of the activities page's ranges, or any number of days (defaulting to the last week)
+    if "range" in request.args:
+        span = request.args["range"]
+        if span not in RANGES:
+            return jsonify(error="invalid range"), 400
+        labels, amounts, title = activity_range(db, session["user_id"], span, [metric])
+    else:
+        days = request.args.get("days", 7, type=int)
+        if days < 1 or days > 366:
+            return jsonify(error="days must be between 1 and 366"), 400
+        labels = last_dates(days)
+        amounts = activity_window(db, session["user_id"], labels, [metric])
+        title = f"Timeline: Last {days} Days"
+
+    return jsonify(metric=metric, dates=labels, amounts=amounts[metric], title=title,
+                   color=BAR_STYLES[metric]["color"], ylabel=BAR_STYLES[metric]["ylabel"])
+
+
+def invalid_activity(date, amount):
+    """Returns an error message if an activity entry is invalid, otherwise None"""
 
-    # storing all form responses
-    date = request.form.get("date")
-    amount = request.form.get("amount")
-    
-    # error checking
     if not date:
-        return render_template("error.html", error="missing date")
+        return "missing date"
 
     try:
         datetime.datetime.strptime(date, '%Y-%m-%d')
@@ -290,179 +438,171 @@ def sleep():
         isdate = False
 
     if not isdate:
-        return render_template("error.html", error="invalid date")
-    
+        return "invalid date"
+
+    # a blank amount is allowed, and deletes the entry for that date
     if amount != "":
         try:
             float(amount)
             isfloat = True
         except:
             isfloat = False
-        
-        if not isfloat:
-            return render_template("error.html", error="invalid amount")
+
+        # nan and inf parse as floats, but can't be added up
+        if not isfloat or not math.isfinite(float(amount)):
+            return "invalid amount"
 
         if float(amount) < 0:
-            return render_template("error.html", error="invalid amount")
+            return "invalid amount"
 
-    # Update/insert amount value
-    current_dates = db.execute("SELECT date FROM sleep WHERE user_id = ?", session["user_id"])
-    if date in [dict["date"] for dict in current_dates]:
-        if not amount:
-            db.execute("DELETE FROM sleep WHERE user_id = ? AND date = ?", session["user_id"], date)
-        else:
-            db.execute("UPDATE sleep SET amount = ? WHERE user_id = ? AND date = ?", amount, session["user_id"], date)
-    else:
-        db.execute("INSERT INTO sleep (user_id, amount, date) VALUES(?, ?, ?)", session["user_id"], amount, date)
-    
-    return redirect("/activities")
+    return None
 
 
-@app.route("/water", methods=["POST"])
-@login_required
-def water():
-    """Adds data into the water table"""
+def log_activity(metric):
+    """Adds, updates or deletes the submitted entry in a metric's table"""
 
     # storing all form responses
     date = request.form.get("date")
     amount = request.form.get("amount")
 
     # error checking
-    if not date:
-        return render_template("error.html", error="missing date")
-
-    try:
-        datetime.datetime.strptime(date, '%Y-%m-%d')
-        isdate = True
-    except:
-        isdate = False
+    error = invalid_activity(date, amount)
+    if error:
+        return render_template("error.html", error=error)
 
-    if not isdate:
-        return render_template("error.html", error="invalid date")
-    
-    if amount != "":
-        try:
-            float(amount)
-            isfloat = True
-        except:
-            isfloat = False
-        
-        if not isfloat:
-            return render_template("error.html", error="invalid amount")
-
-        if float(amount) < 0:
-            return render_template("error.html", error="invalid amount")
-    
     # Update/insert amount value
-    current_dates = db.execute("SELECT date FROM water WHERE user_id = ?", session["user_id"])
-    if date in [dict["date"] for dict in current_dates]:
-        if not amount:
-            db.execute("DELETE FROM water WHERE user_id = ? AND date = ?", session["user_id"], date)
-        else:
-            db.execute("UPDATE water SET amount = ? WHERE user_id = ? AND date = ?", amount, session["user_id"], date)
-    else:
-        db.execute("INSERT INTO water (user_id, amount, date) VALUES(?, ?, ?)", session["user_id"], amount, date)
-    
+    save_activity(db, session["user_id"], metric, date, amount)
+    refresh_recommendations(db, session["user_id"], [metric])
+    changed(session["user_id"])
+
     return redirect("/activities")
 
 
-@app.route("/exercise", methods=["POST"])
+def check_entries(records):
+    """
+    Validates a list of {"metric", "date", "amount"} records with the same rules
+    as the activity forms. Returns (entries, errors) where entries are
+    (metric, date, amount) tuples and errors describe each bad record.
+    """
+
+    entries = []
+    errors = []
+
+    if not isinstance(records, list):
+        return [], ["expected a list of entries"]
+
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append(f"entry {i + 1}: expected metric, date and amount")
+            continue
+
+        metric = record.get("metric")
+        date = record.get("date")
+        amount = record.get("amount")
+
+        # amounts may arrive as JSON numbers; blank or missing means delete
+        if amount == None:
+            amount = ""
+        amount = str(amount).strip()
+
+        if metric not in ACTIVITIES:
+            errors.append(f"entry {i + 1}: invalid metric")
+            continue
+
+        error = invalid_activity(date, amount)
+        if error:
+            errors.append(f"entry {i + 1}: {error}")
+            continue
+
+        entries.append((metric, date, amount))
+
+    return entries, errors
+
+
+@app.route("/api/activities/batch", methods=["POST"])
 @login_required
-def exercise():
-    """Adds data into the exercise table"""
+def batch():
+    """Saves a JSON list of {"metric", "date", "amount"} entries in one transaction"""
 
-    # storing all form responses
-    date = request.form.get("date")
-    amount = request.form.get("amount")
+    records = request.get_json(silent=True)
+    if isinstance(records, dict):
+        records = records.get("entries")
 
-    # error checking
-    if not date:
-        return render_template("error.html", error="missing date")
+    entries, errors = check_entries(records)
+    if errors:
+        return jsonify(errors=errors), 400
 
-    try:
-        datetime.datetime.strptime(date, '%Y-%m-%d')
-        isdate = True
-    except:
-        isdate = False
+    saved = save_activities(db, session["user_id"], entries)
+    refresh_recommendations(db, session["user_id"], {metric for metric, _, _ in entries})
+    changed(session["user_id"])
 
-    if not isdate:
-        return render_template("error.html", error="invalid date")
-    
-    if amount != "":
-        try:
-            float(amount)
-            isfloat = True
-        except:
-            isfloat = False
-        
-        if not isfloat:
-            return render_template("error.html", error="invalid amount")
+    return jsonify(saved=saved)
 
-        if float(amount) < 0:
-            return render_template("error.html", error="invalid amount")
-    
-    # Update/insert amount value
-    current_dates = db.execute("SELECT date FROM exercise WHERE user_id = ?", session["user_id"])
-    if date in [dict["date"] for dict in current_dates]:
-        if not amount:
-            db.execute("DELETE FROM exercise WHERE user_id = ? AND date = ?", session["user_id"], date)
+
+@app.route("/import", methods=["POST"])
+@login_required
+def import_activities():
+    """Imports a CSV (metric,date,amount columns) or JSON file of activity entries"""
+
+    file = request.files.get("file")
+    if not file or not file.filename:
+        return render_template("error.html", error="missing file")
+
+    # parse the upload
+    try:
+        if file.filename.lower().endswith(".json"):
+            records = json.load(file.stream)
         else:
-            db.execute("UPDATE exercise SET amount = ? WHERE user_id = ? AND date = ?", amount, session["user_id"], date)
-    else:
-        db.execute("INSERT INTO exercise (user_id, amount, date) VALUES(?, ?, ?)", session["user_id"], amount, date)
+            records = list(csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8-sig")))
+    except (ValueError, csv.Error):
+        return render_template("error.html", error="could not read file")
+
+    entries, errors = check_entries(records)
+    if errors:
+        return render_template("error.html", error=errors[0] if len(errors) == 1 else f"{errors[0]} (and {len(errors) - 1} more)")
+
+    save_activities(db, session["user_id"], entries)
+    refresh_recommendations(db, session["user_id"], {metric for metric, _, _ in entries})
+    changed(session["user_id"])
 
     return redirect("/activities")
 
 
-@app.route("/relaxation", methods=["POST"])
+@app.route("/sleep", methods=["POST"])
 @login_required
-def relaxation():
-    """Adds data into the relaxation table"""
+def sleep():
+    """Adds data into the sleep table"""
 
-    date = request.form.get("date")
-    amount = request.form.get("amount")
+    return log_activity("sleep")
 
-    # error checking
-    if not date:
-        return render_template("error.html", error="missing date")
 
-    try:
-        datetime.datetime.strptime(date, '%Y-%m-%d')
-        isdate = True
-    except:
-        isdate = False
+@app.route("/water", methods=["POST"])
+@login_required
+def water():
+    """Adds data into the water table"""
 
-    if not isdate:
-        return render_template("error.html", error="invalid date")
-    
-    if amount != "":
-        try:
-            float(amount)
-            isfloat = True
-        except:
-            isfloat = False
-        
-        if not isfloat:
-            return render_template("error.html", error="invalid amount")
+    return log_activity("water")
 
-        if float(amount) < 0:
-            return render_template("error.html", error="invalid amount")
 
-    # Update/insert amount value
-    current_dates = db.execute("SELECT date FROM relaxation WHERE user_id = ?", session["user_id"])
-    if date in [dict["date"] for dict in current_dates]:
-        if not amount:
-            db.execute("DELETE FROM relaxation WHERE user_id = ? AND date = ?", session["user_id"], date)
-        else:
-            db.execute("UPDATE relaxation SET amount = ? WHERE user_id = ? AND date = ?", amount, session["user_id"], date)
-    else:
-        db.execute("INSERT INTO relaxation (user_id, amount, date) VALUES(?, ?, ?)", session["user_id"], amount, date)
+@app.route("/exercise", methods=["POST"])
+@login_required
+def exercise():
+    """Adds data into the exercise table"""
 
-    return redirect("/activities")
+    return log_activity("exercise")
+
+
+@app.route("/relaxation", methods=["POST"])
+@login_required
+def relaxation():
+    """Adds data into the relaxation table"""
+
+    return log_activity("relaxation")
 
 
 @app.route("/goals", methods=["GET", "POST"])
 @login_required
+@conditional
 def goals():
     """Displays goals"""
 
@@ -471,7 +611,10 @@ def goals():
         if not request.form.get("addgoal"):
             return render_template("error.html", error="missing goal!")
         
-        db.execute("INSERT INTO goals (user_id, goal) VALUES(?, ?)", session["user_id"], request.form.get("addgoal"))
+        with db.transaction():
+            db.execute("INSERT INTO goals (user_id, goal) VALUES(?, ?)", session["user_id"], request.form.get("addgoal"))
+            refresh_goal_stats(db, session["user_id"])
+        changed(session["user_id"])
 
         return redirect("/goals")
     
@@ -483,13 +626,22 @@ def goals():
         return render_template("goals.html", completes=completes, incompletes=incompletes)
 
 
+def update_goal(id, column, value):
+    """Sets a column of one of the user's goals and updates their goal totals"""
+
+    with db.transaction():
+        db.execute(f"UPDATE goals SET {column} = ? WHERE id = ? AND user_id = ?", value, id, session["user_id"])
+        refresh_goal_stats(db, session["user_id"])
+    changed(session["user_id"])
+
+
 @app.route("/tocomplete/<id>")
 @login_required
 def tocomplete(id):
     """Changes a goal's completion status to complete"""
 
     # update SQL database and go back to goals page
-    db.execute("UPDATE goals SET complete = ? WHERE id = ?", 1, id)
+    update_goal(id, "complete", 1)
     
     return redirect("/goals")
 
@@ -500,7 +652,7 @@ def toincomplete(id):
     """changes a goal's completion status to incomplete"""
 
     # update SQL database and go back to goals page
-    db.execute("UPDATE goals SET complete = ? WHERE id = ?", 0, id)
+    update_goal(id, "complete", 0)
 
     return redirect("/goals")
 
@@ -511,86 +663,158 @@ def deletegoal(id):
     """ deletes a goal from the database """
 
     # update SQL database and go back to goals page
-    db.execute("UPDATE goals SET deleted = ? WHERE id = ?", 1, id)
+    update_goal(id, "deleted", 1)
 
     return redirect("/goals")
 
 
 @app.route("/analytics")
 @login_required
+@conditional
 def analytics():
     """Displays analytics page """
 
-    # Goal analytics
-    total = db.execute("SELECT COUNT(*) FROM goals WHERE user_id = ?", session["user_id"])[0]["COUNT(*)"]
-    complete = db.execute("SELECT COUNT(*) FROM goals WHERE user_id = ? AND complete = ?", session["user_id"], 1)[0]["COUNT(*)"]
-
-    # Pie chart of current goals
-    current_total = db.execute("SELECT COUNT(*) FROM goals WHERE user_id = ? AND deleted = ?", session["user_id"], 0)[0]["COUNT(*)"]
-    if current_total != 0:
-        labels = 'Complete', 'Incomplete'
-        current_complete = db.execute("SELECT COUNT(*) FROM goals WHERE user_id = ? AND deleted = ? AND complete = ?", session["user_id"], 0, 1)[0]["COUNT(*)"]
-        current_incomplete = db.execute("SELECT COUNT(*) FROM goals WHERE user_id = ? AND deleted = ? AND complete = ?", session["user_id"], 0, 0)[0]["COUNT(*)"]
-        sizes = [current_complete, current_incomplete]
-
-        fig = Figure()
-        ax = fig.subplots()
-        ax.pie(sizes, labels=labels, autopct='%1.1f%%')
-        ax.axis('equal')
-        ax.set_title("Current Goal Completion Rate (excluding deleted goals)")
-        buf = BytesIO()
-        fig.savefig(buf, format="png")
-        pie = base64.b64encode(buf.getbuffer()).decode("ascii")
+    # Goal totals and activity averages, kept up to date by the write handlers
+    stats = user_stats(db, session["user_id"])
+
+    # Pie chart of current goals (drawn by the browser in client mode)
+    if app.config["CHART_MODE"] == "client":
+        pie = None
     else:
-        sizes = [1]
-        fig = Figure()
-        ax = fig.subplots()
-        ax.pie(sizes)
-        ax.set_title("No Current Goals")
-        buf = BytesIO()
-        fig.savefig(buf, format="png")
-        pie = base64.b64encode(buf.getbuffer()).decode("ascii")
-
-    # Activitiy Averages
-    today = datetime.datetime.now()
-    dates = []
-
-    for i in range(7):
-        delta = datetime.timedelta(days=(6-i))
-        rawdate = str(today - delta)[:10]
-        dates.append(rawdate)
-
-    sleep_overall = db.execute("SELECT AVG(amount) AS average FROM sleep WHERE user_id=?", session["user_id"])[0]["average"]
-    if sleep_overall != None:
-        sleep_overall = round(sleep_overall,2)
-    water_overall = db.execute("SELECT AVG(amount) AS average FROM water WHERE user_id=?", session["user_id"])[0]["average"]
-    if water_overall != None:
-        water_overall = round(water_overall,2)
-    exercise_overall = db.execute("SELECT AVG(amount) AS average FROM exercise WHERE user_id=?", session["user_id"])[0]["average"]
-    if exercise_overall != None:
-        exercise_overall = round(exercise_overall,2)
-    relax_overall = db.execute("SELECT AVG(amount) AS average FROM relaxation WHERE user_id=?", session["user_id"])[0]["average"]
-    if relax_overall != None:
-        relax_overall = round(relax_overall,2)
-
-    # Activity Histories
-    sleep = db.execute("SELECT amount, date FROM sleep WHERE user_id=? ORDER BY date", session["user_id"])
-    water = db.execute("SELECT amount, date FROM water WHERE user_id=? ORDER BY date", session["user_id"])
-    exercise = db.execute("SELECT amount, date FROM exercise WHERE user_id=? ORDER BY date", session["user_id"])
-    relax = db.execute("SELECT amount, date FROM relaxation WHERE user_id=? ORDER BY date", session["user_id"])
-
-    return render_template("analytics.html", total=total, complete=complete, pie=pie, 
-                            sleep_overall=sleep_overall, water_overall=water_overall, 
-                            exercise_overall=exercise_overall, relax_overall=relax_overall, 
-                            sleep=sleep, water=water, exercise=exercise, relax=relax)
+        current = (stats["goals_current_complete"], stats["goals_current_incomplete"])
+        pie = chart_cache.chart(session["user_id"], "goals", None, g.user["theme"], current,
+                                lambda: goals_chart(*current))
+
+    # Activity Histories (the first page of the selected window; older pages come from /api/history)
+    window = request.args.get("window", "30")
+    if window not in HISTORY_WINDOWS:
+        return render_template("error.html", error="invalid window")
+    history = activity_history(db, session["user_id"], since=history_since(window), limit=HISTORY_PAGE)
+
+    # Where the user's averages fall among everyone's, and how everyone's are spread (from the last population-stats run)
+    ranks = percentile_ranks(db, stats)
+    distributions = histograms(db)
+
+    return render_template("analytics.html", chart_mode=app.config["CHART_MODE"], total=stats["goals_total"],
+                            complete=stats["goals_complete"], pie=pie,
+                            sleep_overall=stats["sleep_average"], water_overall=stats["water_average"],
+                            exercise_overall=stats["exercise_average"], relax_overall=stats["relaxation_average"], ranks=ranks,
+                            distributions=distributions,
+                            window=window, sleep=history["sleep"], water=history["water"],
+                            exercise=history["exercise"], relax=history["relaxation"])
+
+
+def history_since(window):
+    """Returns the first date included in a history window, or None for all of it"""
+
+    if HISTORY_WINDOWS[window] is None:
+        return None
+    return last_dates(HISTORY_WINDOWS[window])[0]
+
+
+@app.route("/api/history/<metric>")
+@login_required
+@conditional
+def history(metric):
+    """Returns the next page of a metric's history as JSON"""
+
+    if metric not in ACTIVITIES:
+        return jsonify(error="unknown metric"), 404
+
+    window = request.args.get("window", "30")
+    if window not in HISTORY_WINDOWS:
+        return jsonify(error="invalid window"), 400
+
+    page = activity_history(db, session["user_id"], [metric], since=history_since(window),
+                            before=request.args.get("before"), limit=HISTORY_PAGE)[metric]
+    return jsonify(metric=metric, rows=page["rows"], next=page["next"])
+
+
+@app.route("/api/population/<metric>")
+@login_required
+@conditional
+def population(metric):
+    """Returns the histogram of all users' averages of a metric, and the user's own average and percentile, as JSON"""
+
+    if metric not in ACTIVITIES:
+        return jsonify(error="unknown metric"), 404
+
+    stats = user_stats(db, session["user_id"])
+    return jsonify(metric=metric, bins=histogram(db, metric), average=stats[metric + "_average"],
+                   percentile=percentile_ranks(db, stats).get(metric))
+
+
+# Columns of the export; activity rows fill in date and amount, goal rows the rest
+EXPORT_COLUMNS = ["metric", "date", "amount", "id", "goal", "complete", "deleted"]
+
+
+def export_rows(user_id):
+    """Yields every activity entry and goal the user has, straight from the database cursor"""
+
+    # one table at a time, so rows come straight off the (user_id, date) index already in order
+    # instead of the whole history being sorted before the first one is sent
+    for metric in sorted(ACTIVITIES):
+        yield from db.iterate(f"SELECT '{metric}' AS metric, date, amount FROM {metric} WHERE user_id = ? ORDER BY date", user_id)
+    yield from db.iterate("SELECT 'goals' AS metric, id, goal, complete, deleted FROM goals WHERE user_id = ? ORDER BY id", user_id)
+
+
+def export_chunks(rows, format, compress, size=65536):
+    """Encodes rows as CSV or newline-delimited JSON in chunks of about `size` bytes, gzipped if asked"""
+
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+
+    if format == "csv":
+        writer.writeheader()
+
+    for row in rows:
+        if format == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + "\n")
+
+        if buffer.tell() >= size:
+            chunk = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            yield compressor.compress(chunk) if compressor else chunk
+
+    chunk = buffer.getvalue().encode()
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+@app.route("/export")
+@login_required
+def export():
+    """Streams all of the user's data as CSV or newline-delimited JSON, optionally gzipped"""
+
+    format = request.args.get("format", "csv")
+    if format not in ["csv", "ndjson"]:
+        return render_template("error.html", error="invalid export format")
+    compress = request.args.get("gzip") == "1"
+
+    filename = "down_time." + format
+    mimetype = "text/csv" if format == "csv" else "application/x-ndjson"
+    if compress:
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(export_chunks(export_rows(session["user_id"]), format, compress), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 
 @app.route("/recommendations")
 @login_required
+@conditional
 def recommend():
     """ displays the recommendation page """
 
-    return render_template("recommendations.html")
+    # precomputed whenever the user logs data (and daily by flask refresh-recommendations)
+    return render_template("recommendations.html", recommendations=recommendations(db, session["user_id"]))
 
 
 @app.route("/account", methods=["GET"])
@@ -598,12 +822,8 @@ def recommend():
 def account():
     """ displays the account settings page """
 
-    # get current username and theme
-    username = db.execute("SELECT username FROM users WHERE id = ?", session["user_id"])[0]["username"]
-    theme = db.execute("SELECT theme FROM users WHERE id = ?", session["user_id"])[0]["theme"]
-    
-    # return the account template
-    return render_template("account.html", username=username, theme=theme)
+    # return the account template with the current username and theme
+    return render_template("account.html", username=g.user["username"], theme=g.user["theme"])
 
 
 @app.route("/username", methods=["POST"])
@@ -620,6 +840,7 @@ def username():
 
     # update username and return to the account page
     db.execute("UPDATE users SET username = ? WHERE id = ?", new_username, session["user_id"])
+    changed(session["user_id"])
     
     return redirect("/account")
 
@@ -641,7 +862,7 @@ def password():
 
     # Ensures current password is correct
     current = db.execute("SELECT hash FROM users WHERE id = ?", session["user_id"])
-    if not check_password_hash(current[0]["hash"], current_password):
+    if not hasher.check(current[0]["hash"], current_password):
         return render_template("error.html", error="incorrect password!")
 
     # Ensures new password and confirmation match
@@ -649,8 +870,9 @@ def password():
         return render_template("error.html", error="passwords do not match!")
 
     # update hashed password and log user out
-    hash = generate_password_hash(new_password, method='pbkdf2:sha256', salt_length=8)
+    hash = hasher.hash(new_password)
     db.execute("UPDATE users SET hash = ? WHERE id = ?", hash, session["user_id"])
+    changed(session["user_id"])
 
     # log user out 
     return redirect("/logout")
@@ -668,5 +890,6 @@ def color():
 
     # update database and return to account page
     db.execute("UPDATE users SET theme = ? WHERE id = ?", theme, session["user_id"])
+    changed(session["user_id"])
     
     return redirect("/account")
\ No newline at end of file
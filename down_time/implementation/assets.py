@@ -0,0 +1,60 @@
+from flask import has_request_context, request, send_from_directory
+import json
+import mimetypes
+import os
+
+# How long browsers may keep fingerprinted files: a year, the most HTTP caches honour
+MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Assets:
+    """
+    Serves the fingerprinted copies of static/ that build_static.py writes to static/dist.
+
+    url_for("static", filename=...) is rewritten to the file's hashed name (its
+    WebP variant for browsers that list image/webp in Accept), and those files are served
+    with immutable one-year cache headers, precompressed with brotli or gzip
+    when the browser accepts it. Files missing from the manifest are served
+    from static/ as usual.
+    """
+
+    def __init__(self, app):
+        self.directory = os.path.join(app.static_folder, "dist")
+        with open(os.path.join(self.directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+
+        # hashed name -> encodings it was precompressed with
+        self.encodings = {entry["file"]: entry.get("encodings", []) for entry in self.manifest.values()}
+
+        app.url_defaults(self.rewrite)
+        app.add_url_rule(app.static_url_path + "/dist/<path:filename>", "dist", self.serve)
+
+    def rewrite(self, endpoint, values):
+        """Points url_for("static", ...) at the built file"""
+
+        if endpoint != "static":
+            return
+        entry = self.manifest.get(values.get("filename"))
+        if entry is None:
+            return
+        if "webp" in entry and has_request_context() and "image/webp" in request.headers.get("Accept", ""):
+            values["filename"] = "dist/" + entry["webp"]
+        else:
+            values["filename"] = "dist/" + entry["file"]
+
+    def serve(self, filename):
+        """Sends a built file, precompressed if the browser accepts one of its encodings"""
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in [("br", ".br"), ("gzip", ".gz")]:
+            if encoding in self.encodings.get(filename, []) and request.accept_encodings[encoding]:
+                response = send_from_directory(self.directory, filename + suffix, mimetype=mimetype, max_age=MAX_AGE)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, filename, mimetype=mimetype, max_age=MAX_AGE)
+
+        response.headers["Vary"] = "Accept-Encoding"
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,11 @@
+"""
+Benchmarks for Down Time.
+
+Run from the implementation directory, e.g.
+
+    python -m benchmark generate --users 100 --days 365
+    python -m benchmark latency --output before.json
+    python -m benchmark startup --runs 10
+    python -m benchmark throughput --url http://127.0.0.1:5000 --concurrency 16
+    python -m benchmark compare before.json after.json
+"""
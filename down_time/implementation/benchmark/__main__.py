@@ -0,0 +1,126 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from benchmark.generate import generate
+
+
+def write(results, output):
+    """Writes results as JSON to a file, or stdout if no file was given"""
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def bench_users(database, limit):
+    """Returns up to `limit` of the generated users in a database"""
+
+    from database import Database
+
+    rows = Database(database).execute("SELECT username FROM users WHERE username LIKE 'bench%' ORDER BY id LIMIT ?", limit)
+    if not rows:
+        sys.exit(f"no benchmark users in {database}; run `python -m benchmark generate` first")
+    return [row["username"] for row in rows]
+
+
+def compare(old, new, threshold):
+    """Returns the routes whose p95 latency or query count got worse by more than threshold"""
+
+    regressions = {}
+    for name, after in new["routes"].items():
+        before = old["routes"].get(name)
+        if before is None:
+            continue
+        for key in ["p95_ms", "queries_per_request"]:
+            if before[key] and after[key] > before[key] * (1 + threshold):
+                regressions.setdefault(name, {})[key] = {"before": before[key], "after": after[key]}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Down Time benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("generate", help="seed a database with synthetic users")
+    command.add_argument("--database", default="bench.db")
+    command.add_argument("--source", default="data.db", help="database whose schema is copied")
+    command.add_argument("--users", type=int, default=100)
+    command.add_argument("--days", type=int, default=365)
+    command.add_argument("--goals", type=int, default=10)
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--append", action="store_true", help="add to the database instead of replacing it")
+
+    command = commands.add_parser("latency", help="per-route latency and queries per request via the test client")
+    command.add_argument("--database", default="bench.db")
+    command.add_argument("--session-db", default="bench-sessions.db")
+    command.add_argument("--users", type=int, default=20, help="how many generated users to spread requests over")
+    command.add_argument("--iterations", type=int, default=100)
+    command.add_argument("--output")
+
+    command = commands.add_parser("throughput", help="concurrent sessions against a running server")
+    command.add_argument("--url", default="http://127.0.0.1:5000")
+    command.add_argument("--database", default="bench.db", help="the database the server is using")
+    command.add_argument("--users", type=int, default=100)
+    command.add_argument("--concurrency", type=int, default=8)
+    command.add_argument("--duration", type=float, default=30)
+    command.add_argument("--output")
+
+    command = commands.add_parser("startup", help="time a fresh worker importing the app and drawing its first chart")
+    command.add_argument("--database", default="bench.db")
+    command.add_argument("--session-db", default="bench-sessions.db")
+    command.add_argument("--runs", type=int, default=10)
+    command.add_argument("--output")
+
+    command = commands.add_parser("compare", help="list regressions between two latency results")
+    command.add_argument("old")
+    command.add_argument("new")
+    command.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+
+    args = parser.parse_args()
+    meta = {"command": args.command, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version()}
+
+    if args.command == "generate":
+        start = time.perf_counter()
+        usernames = generate(args.database, args.users, args.days, args.goals, seed=args.seed,
+                             source=args.source, fresh=not args.append)
+        print(f"created {len(usernames)} users in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    elif args.command == "latency":
+        from benchmark.harness import latency, load_app
+
+        usernames = bench_users(args.database, args.users)
+        module = load_app(args.database, args.session_db)
+        meta.update(database=args.database, users=len(usernames), iterations=args.iterations)
+        write({"meta": meta, "routes": latency(module, usernames, args.iterations)}, args.output)
+
+    elif args.command == "throughput":
+        from benchmark.throughput import throughput
+
+        usernames = bench_users(args.database, args.users)
+        meta.update(url=args.url, users=len(usernames), duration=args.duration)
+        write({"meta": meta, "throughput": throughput(args.url, usernames, args.concurrency, args.duration)}, args.output)
+
+    elif args.command == "startup":
+        from benchmark.startup import startup
+
+        meta.update(database=args.database, runs=args.runs)
+        write({"meta": meta, "startup": startup(args.database, args.session_db, args.runs)}, args.output)
+
+    elif args.command == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        write(regressions, None)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from werkzeug.security import generate_password_hash
+import datetime
+import os
+import random
+import sqlite3
+
+from cohort import rebuild_population
+from database import Database
+from hashing import DEFAULT_METHOD
+from migrations import migrate
+from queries import ACTIVITIES, rebuild_rollups, rebuild_stats
+from recommendations import rebuild_recommendations
+
+# Every generated user logs in with this password
+PASSWORD = "benchmark"
+
+# (low, high) of the random amount logged for each activity
+AMOUNTS = {
+    "sleep": (4, 10),
+    "water": (0.5, 4),
+    "exercise": (0, 120),
+    "relaxation": (0, 180),
+}
+
+
+def copy_schema(source, path):
+    """Creates an empty database at path with the same tables and applied migrations as source"""
+
+    with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+        for (sql,) in src.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"):
+            dst.execute(sql)
+
+        # the copied schema already includes any migrations source has had
+        if src.execute("SELECT name FROM sqlite_master WHERE name = 'schema_migrations'").fetchone():
+            dst.executemany("INSERT INTO schema_migrations VALUES(?, ?, ?)", src.execute("SELECT * FROM schema_migrations"))
+
+
+def generate(path, users=100, days=365, goals=10, fill=0.9, seed=0, source="data.db", fresh=True):
+    """
+    Seeds the database at path with `users` users, each with up to `days` days of
+    every activity (each day logged with probability `fill`) and `goals` goals.
+
+    With fresh=True the database is first replaced by an empty copy of source's
+    schema. Returns the usernames that were created.
+    """
+
+    if fresh:
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        copy_schema(source, path)
+
+    db = Database(path)
+    migrate(db)
+
+    rng = random.Random(seed)
+    hash = generate_password_hash(PASSWORD, DEFAULT_METHOD, salt_length=8)
+    today = datetime.date.today()
+    dates = [str(today - datetime.timedelta(days=i)) for i in range(days)]
+    start = db.execute("SELECT COALESCE(MAX(id), 0) AS id FROM users")[0]["id"]
+
+    usernames = []
+    with db.transaction():
+        for i in range(users):
+            username = f"bench{start + i + 1}"
+            user_id = db.execute("INSERT INTO users (username, hash, name, theme) VALUES(?, ?, ?, ?)",
+                                 username, hash, "Bench", rng.choice(["light", "dark", "pastel"]))
+            usernames.append(username)
+
+            for metric in ACTIVITIES:
+                low, high = AMOUNTS[metric]
+                db.executemany(f"INSERT INTO {metric} (user_id, amount, date) VALUES(?, ?, ?)",
+                               [(user_id, round(rng.uniform(low, high), 1), date) for date in dates if rng.random() < fill])
+
+            db.executemany("INSERT INTO goals (user_id, goal, complete, deleted) VALUES(?, ?, ?, ?)",
+                           [(user_id, f"goal {j}", int(rng.random() < 0.5), int(rng.random() < 0.2)) for j in range(goals)])
+
+    # bring the summary tables in line with the bulk-loaded rows
+    rebuild_stats(db)
+    rebuild_rollups(db)
+    rebuild_recommendations(db)
+    rebuild_population(db)
+
+    return usernames
@@ -0,0 +1,148 @@
+import datetime
+import importlib
+import io
+import math
+import os
+import random
+import time
+
+from benchmark.generate import PASSWORD
+
+# (name, method, path, form data) for every route the harness exercises.
+# Form data may be a function of the iteration number so writes don't all hit one row;
+# a list is sent as a JSON body instead.
+ROUTES = [
+    ("GET /", "GET", "/", None),
+    ("GET /activities", "GET", "/activities", None),
+    ("GET /activities?range=12w", "GET", "/activities?range=12w", None),
+    ("GET /activities?range=12m", "GET", "/activities?range=12m", None),
+    ("GET /analytics", "GET", "/analytics", None),
+    ("GET /analytics?window=all", "GET", "/analytics?window=all", None),
+    ("GET /goals", "GET", "/goals", None),
+    ("GET /recommendations", "GET", "/recommendations", None),
+    ("GET /account", "GET", "/account", None),
+    ("GET /api/series/sleep", "GET", "/api/series/sleep?days=30", None),
+    ("GET /api/series/goals", "GET", "/api/series/goals", None),
+    ("GET /api/population/sleep", "GET", "/api/population/sleep", None),
+    ("GET /api/history/sleep", "GET", "/api/history/sleep?window=all&before=9999-12-31", None),
+    ("GET /export", "GET", "/export", None),
+    ("GET /export?format=ndjson&gzip=1", "GET", "/export?format=ndjson&gzip=1", None),
+    ("POST /sleep", "POST", "/sleep",
+        lambda i: {"date": str(datetime.date.today() - datetime.timedelta(days=i % 30)), "amount": str(i % 10)}),
+    ("POST /api/activities/batch", "POST", "/api/activities/batch",
+        lambda i: [{"metric": metric, "date": str(datetime.date.today() - datetime.timedelta(days=(i + day) % 30)),
+                    "amount": str((i + day) % 10)} for metric in ["water", "exercise"] for day in range(7)]),
+    ("POST /import", "POST", "/import",
+        lambda i: {"file": (io.BytesIO("metric,date,amount\n".encode() + "".join(
+            f"relaxation,{datetime.date.today() - datetime.timedelta(days=(i + day) % 30)},{(i + day) % 60}\n"
+            for day in range(7)).encode()), "import.csv")}),
+    ("POST /goals", "POST", "/goals", lambda i: {"addgoal": f"benchmark goal {i}"}),
+    ("POST /login", "POST", "/login", None),
+]
+
+
+def load_app(database, session_db):
+    """Imports app.py against the given databases (the app reads them from the environment)"""
+
+    os.environ["DATABASE"] = database
+    os.environ["SESSION_DB"] = session_db
+    return importlib.import_module("app")
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list"""
+
+    if not values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def summarize(latencies):
+    """Returns the latency percentiles of a list of durations in seconds, in milliseconds"""
+
+    latencies = sorted(latencies)
+    return {
+        "n": len(latencies),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+        "p50_ms": round(1000 * percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(1000 * percentile(latencies, 95), 3) if latencies else None,
+        "p99_ms": round(1000 * percentile(latencies, 99), 3) if latencies else None,
+    }
+
+
+class QueryCounter:
+    """Counts the statements run through a Database object"""
+
+    def __init__(self, db):
+        self.count = 0
+        execute = db.execute
+        executemany = db.executemany
+        iterate = db.iterate
+
+        def counted_execute(*args, **kwargs):
+            self.count += 1
+            return execute(*args, **kwargs)
+
+        def counted_executemany(*args, **kwargs):
+            self.count += 1
+            return executemany(*args, **kwargs)
+
+        def counted_iterate(*args, **kwargs):
+            self.count += 1
+            return iterate(*args, **kwargs)
+
+        db.execute = counted_execute
+        db.executemany = counted_executemany
+        db.iterate = counted_iterate
+
+
+def latency(module, usernames, iterations=100, routes=ROUTES, seed=0):
+    """
+    Sends every route `iterations` times through Flask's test client, spread
+    over the given users, and returns latency percentiles and queries per request.
+    """
+
+    app = module.app
+    counter = QueryCounter(module.db)
+    rng = random.Random(seed)
+
+    # one logged in client per user
+    clients = {}
+    for username in usernames:
+        client = app.test_client()
+        client.post("/login", data={"username": username, "password": PASSWORD})
+        clients[username] = client
+
+    results = {}
+    for name, method, path, data in routes:
+        latencies = []
+        queries = 0
+        errors = 0
+
+        for i in range(iterations):
+            username = rng.choice(usernames)
+            client = clients[username]
+            if name == "POST /login":
+                form = {"username": username, "password": PASSWORD}
+            else:
+                form = data(i) if callable(data) else data
+
+            before = counter.count
+            start = time.perf_counter()
+            if isinstance(form, list):
+                response = client.open(path, method=method, json=form)
+            else:
+                response = client.open(path, method=method, data=form)
+            # streamed responses (like /export) only do their work as the body is read
+            response.get_data()
+            latencies.append(time.perf_counter() - start)
+            queries += counter.count - before
+            if response.status_code >= 400:
+                errors += 1
+
+        results[name] = summarize(latencies)
+        results[name]["queries_per_request"] = round(queries / iterations, 2)
+        results[name]["errors"] = errors
+
+    return results
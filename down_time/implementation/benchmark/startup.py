@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import time
+
+from benchmark.harness import summarize
+
+# Run in a fresh interpreter: times importing the app (what every new worker pays),
+# then the first chart drawn, and reports whether matplotlib was loaded by the import
+CHILD = """
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = "matplotlib" in sys.modules
+app.bar_chart("sleep", ["2000-01-01"], [1])
+print(imported - start, time.perf_counter() - imported, int(loaded))
+"""
+
+
+def startup(database, session_db, runs=10, env=None):
+    """
+    Starts `runs` fresh interpreters that import app.py and returns percentiles
+    of the import time, the first chart's time and the whole process's time.
+    """
+
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE=database, SESSION_DB=session_db, **(env or {}))
+
+    imports, charts, processes = [], [], []
+    loaded = False
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", CHILD], cwd=directory, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        processes.append(time.perf_counter() - start)
+
+        imported, chart, matplotlib = output.split()[-3:]
+        imports.append(float(imported))
+        charts.append(float(chart))
+        loaded = loaded or matplotlib == "1"
+
+    return {"import": summarize(imports), "first_chart": summarize(charts), "process": summarize(processes),
+            "matplotlib_loaded_at_import": loaded}
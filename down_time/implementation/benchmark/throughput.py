@@ -0,0 +1,61 @@
+from http.cookiejar import CookieJar
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmark.generate import PASSWORD
+from benchmark.harness import summarize
+
+# Pages each simulated user cycles through
+PAGES = ["/", "/activities", "/goals", "/analytics", "/account", "/api/series/sleep"]
+
+
+def session(base_url, username, deadline, results):
+    """Logs in as username and requests PAGES in a loop until the deadline"""
+
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    login = urllib.parse.urlencode({"username": username, "password": PASSWORD}).encode()
+    opener.open(base_url + "/login", login).read()
+
+    latencies = []
+    errors = 0
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            opener.open(base_url + PAGES[i % len(PAGES)]).read()
+        except (urllib.error.URLError, OSError):
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+    results.append((latencies, errors))
+
+
+def throughput(base_url, usernames, concurrency=8, duration=30):
+    """
+    Drives `concurrency` concurrent logged in sessions against a running server
+    for `duration` seconds and returns requests per second and latency percentiles.
+    """
+
+    base_url = base_url.rstrip("/")
+    deadline = time.monotonic() + duration
+    results = []
+
+    threads = [threading.Thread(target=session, args=(base_url, usernames[i % len(usernames)], deadline, results))
+               for i in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    latencies = [latency for session_latencies, errors in results for latency in session_latencies]
+    summary = summarize(latencies)
+    summary["errors"] = sum(errors for session_latencies, errors in results)
+    summary["requests_per_second"] = round(len(latencies) / elapsed, 2)
+    summary["concurrency"] = concurrency
+    return summary
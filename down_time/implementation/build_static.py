@@ -0,0 +1,128 @@
+"""
+Builds the production copy of static/ in static/dist, for DOWN_TIME_ENV=production.
+
+Every file is copied under a name containing a hash of its contents, so it can
+be cached forever: images are scaled down to MAX_WIDTH and get a WebP variant
+(needs Pillow), and text files get .gz and .br precompressed variants (.br needs
+the brotli package). manifest.json maps each original name to its built files.
+
+Run from the implementation directory before starting the app:
+
+    python build_static.py
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST = os.path.join(STATIC, "dist")
+
+# Images are shown at most half the page wide, so this is enough even for high-DPI screens
+MAX_WIDTH = 1200
+IMAGES = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+# Text files worth precompressing
+COMPRESS = {".css", ".js", ".svg", ".ico", ".json", ".txt"}
+
+
+def fingerprint(name, data):
+    """Returns name with a hash of data before its extension, e.g. styles.3f2a9c1b.css"""
+
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def optimize(name, data):
+    """Returns the image scaled down to MAX_WIDTH and re-encoded, plus a WebP version, or (data, None) without Pillow"""
+
+    if Image is None:
+        return data, None
+
+    image = Image.open(io.BytesIO(data))
+    if image.width > MAX_WIDTH:
+        image = image.resize((MAX_WIDTH, round(image.height * MAX_WIDTH / image.width)), Image.LANCZOS)
+
+    buf = io.BytesIO()
+    format = IMAGES[os.path.splitext(name)[1].lower()]
+    if format == "JPEG":
+        image.convert("RGB").save(buf, format, quality=85, optimize=True, progressive=True)
+    else:
+        image.save(buf, format, optimize=True)
+    resized = buf.getvalue()
+
+    buf = io.BytesIO()
+    image.save(buf, "WEBP", quality=80, method=6)
+    webp = buf.getvalue()
+
+    # keep the original if re-encoding didn't make it any smaller
+    return (resized if len(resized) < len(data) else data), webp
+
+
+def write(name, data):
+    with open(os.path.join(DIST, name), "wb") as f:
+        f.write(data)
+
+
+def build():
+    """Rebuilds static/dist and its manifest, returning the manifest"""
+
+    shutil.rmtree(DIST, ignore_errors=True)
+    os.makedirs(DIST)
+
+    manifest = {}
+    for name in sorted(os.listdir(STATIC)):
+        path = os.path.join(STATIC, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        entry = {}
+
+        if ext in IMAGES:
+            data, webp = optimize(name, data)
+            if webp is not None and len(webp) < len(data):
+                entry["webp"] = fingerprint(os.path.splitext(name)[0] + ".webp", webp)
+                write(entry["webp"], webp)
+
+        entry["file"] = fingerprint(name, data)
+        write(entry["file"], data)
+
+        if ext in COMPRESS:
+            entry["encodings"] = []
+            if brotli is not None:
+                write(entry["file"] + ".br", brotli.compress(data, quality=11))
+                entry["encodings"].append("br")
+            write(entry["file"] + ".gz", gzip.compress(data, 9, mtime=0))
+            entry["encodings"].append("gzip")
+
+        manifest[name] = entry
+
+    with open(os.path.join(DIST, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    if Image is None:
+        print("Pillow isn't installed: images are copied as they are")
+    if brotli is None:
+        print("brotli isn't installed: only gzip variants are written")
+
+    manifest = build()
+    before = sum(os.path.getsize(os.path.join(STATIC, name)) for name in manifest)
+    after = sum(os.path.getsize(os.path.join(DIST, entry.get("webp", entry["file"]))) for entry in manifest.values())
+    print(f"built {len(manifest)} files into {DIST}: {before // 1024} KB -> {after // 1024} KB")
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from io import BytesIO
+import base64
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+# Colors and y-axis labels for each activity's bar graph
+BAR_STYLES = {
+    "sleep": {"color": "purple", "ylabel": "Hours"},
+    "water": {"color": None, "ylabel": "Liters"},
+    "exercise": {"color": "red", "ylabel": "Minutes"},
+    "relaxation": {"color": "green", "ylabel": "Minutes"},
+}
+
+
+def figure():
+    """
+    Returns a new matplotlib Figure. matplotlib is imported here rather than at
+    the top of the module because importing it takes longer than the rest of
+    the app's startup put together, and most requests never draw a chart.
+    """
+
+    from matplotlib.figure import Figure
+
+    return Figure()
+
+
+def prewarm():
+    """Imports matplotlib and draws a throwaway chart so the first real chart isn't slowed by font and backend setup"""
+
+    bar_chart("sleep", ["2000-01-01"], [0])
+
+
+def to_png(fig):
+    """Rasterizes a figure into PNG bytes"""
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return bytes(buf.getbuffer())
+
+
+def bar_chart(metric, dates, amounts, title="Timeline: Last 7 Days"):
+    """Draws the bar graph of a metric's amounts over the given dates"""
+
+    style = BAR_STYLES[metric]
+
+    fig = figure()
+    ax = fig.subplots()
+    ax.bar(dates, amounts, color=style["color"])
+    ax.set_xlabel('Date')
+    ax.set_ylabel(style["ylabel"])
+    ax.set_title(title)
+    fig.autofmt_xdate()
+    return to_png(fig)
+
+
+def goals_chart(current_complete, current_incomplete):
+    """Draws the pie chart of the user's current (not deleted) goals"""
+
+    fig = figure()
+    ax = fig.subplots()
+
+    # If there are no current goals, the pie is just one empty slice
+    if current_complete + current_incomplete != 0:
+        labels = 'Complete', 'Incomplete'
+        ax.pie([current_complete, current_incomplete], labels=labels, autopct='%1.1f%%')
+        ax.axis('equal')
+        ax.set_title("Current Goal Completion Rate (excluding deleted goals)")
+    else:
+        ax.pie([1])
+        ax.set_title("No Current Goals")
+    return to_png(fig)
+
+
+class ChartCache:
+    """
+    Bounded LRU cache of rendered charts, with an optional on-disk tier.
+
+    Charts are keyed by (user_id, chart, window, theme) plus a digest of the
+    data drawn, so a stale entry can never be served. Write handlers still
+    call invalidate() so a user's old charts don't linger in memory or on disk.
+
+    Date windows move every day, so charts keep being written for users who
+    never log anything. Each user's directory on disk keeps at most
+    `disk_size` charts, the least recently used being deleted as new ones are written.
+    """
+
+    def __init__(self, maxsize=256, directory=None, disk_size=64):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.disk_size = disk_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # called as on_render(seconds) after every chart actually drawn, e.g. by instrumentation
+        self.on_render = None
+
+    def chart(self, user_id, name, window, theme, data, render):
+        """Returns the chart as base64-encoded PNG, calling render() only on a miss"""
+
+        digest = hashlib.sha1(repr((name, window, theme, data)).encode()).hexdigest()
+        key = (user_id, digest)
+
+        # in-memory tier
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        # on-disk tier, so charts survive worker restarts
+        path = None
+        png = None
+        if self.directory:
+            path = os.path.join(self.directory, str(user_id), digest + ".png")
+            try:
+                with open(path, "rb") as f:
+                    png = f.read()
+                # a read counts as a use, so prune() keeps the charts still being shown
+                os.utime(path)
+            except OSError:
+                png = None
+
+        if png is None:
+            start = time.perf_counter()
+            png = render()
+            if self.on_render:
+                self.on_render(time.perf_counter() - start)
+            if path:
+                self.write(path, png)
+
+        encoded = base64.b64encode(png).decode("ascii")
+        with self.lock:
+            self.entries[key] = encoded
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return encoded
+
+    def write(self, path, png):
+        """Writes a PNG to the disk tier without ever exposing a partial file"""
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+        except OSError:
+            # the disk tier is best effort; the chart was still rendered
+            return
+        self.prune(os.path.dirname(path))
+
+    def prune(self, directory):
+        """Deletes the least recently used charts in a user's directory beyond disk_size"""
+
+        charts = []
+        try:
+            for entry in os.scandir(directory):
+                if entry.name.endswith(".png"):
+                    charts.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            return
+
+        charts.sort(reverse=True)
+        for _, path in charts[self.disk_size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def invalidate(self, user_id):
+        """Drops every cached chart belonging to a user"""
+
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                del self.entries[key]
+
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, str(user_id)), ignore_errors=True)
@@ -0,0 +1,105 @@
+from bisect import bisect_left
+
+from queries import ACTIVITIES, bump_data_version
+
+# Number of equal-width bins in each metric's histogram of per-user averages
+HISTOGRAM_BINS = 20
+
+
+def user_averages(db, metric, chunk=100000):
+    """
+    Returns every user's average amount of a metric as a NumPy array, leaving
+    out users who never logged it. Rows are read straight off the table in
+    chunks and summed per user with bincount, so memory stays bounded by the
+    number of users rather than the number of entries.
+    """
+
+    import numpy as np
+
+    size = (db.execute("SELECT MAX(id) AS id FROM users")[0]["id"] or 0) + 1
+    sums = np.zeros(size)
+    counts = np.zeros(size)
+
+    connection = db.open()
+    try:
+        # the same rows user_stats counts, so percentile_ranks() compares like with like
+        cursor = connection.execute(f"SELECT user_id, amount FROM {metric} WHERE amount IS NOT NULL")
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            rows = np.array(rows, dtype=float)
+            ids = rows[:, 0].astype(np.int64)
+            sums += np.bincount(ids, weights=rows[:, 1], minlength=size)
+            counts += np.bincount(ids, minlength=size)
+    finally:
+        connection.close()
+
+    logged = counts > 0
+    return sums[logged] / counts[logged]
+
+
+def rebuild_population(db):
+    """
+    Recomputes the population tables from every user's average of each metric:
+    the 0th to 100th percentiles, and a histogram of HISTOGRAM_BINS equal-width bins.
+    Meant to run as a batch job (flask population-stats), not on requests.
+    """
+
+    import numpy as np
+
+    percentiles = []
+    bins = []
+    for metric in ACTIVITIES:
+        averages = user_averages(db, metric)
+        if len(averages) == 0:
+            continue
+
+        values = np.percentile(averages, np.arange(101))
+        percentiles += [(metric, p, float(value)) for p, value in enumerate(values)]
+
+        counts, edges = np.histogram(averages, bins=HISTOGRAM_BINS)
+        bins += [(metric, i, float(edges[i]), float(edges[i + 1]), int(count)) for i, count in enumerate(counts)]
+
+    with db.transaction():
+        db.execute("DELETE FROM population_percentiles")
+        db.execute("DELETE FROM population_histogram")
+        db.executemany("INSERT INTO population_percentiles (metric, percentile, value) VALUES(?, ?, ?)", percentiles)
+        db.executemany("INSERT INTO population_histogram (metric, bin, low, high, users) VALUES(?, ?, ?, ?, ?)", bins)
+
+        # every user's analytics page shows these
+        bump_data_version(db)
+
+
+def percentile_ranks(db, stats):
+    """
+    Returns, for each metric the user has an average for in stats (from
+    user_stats()), the percentage of users whose average is lower.
+    Metrics without population data yet are left out.
+    """
+
+    values = {}
+    for row in db.execute("SELECT metric, value FROM population_percentiles ORDER BY metric, percentile"):
+        values.setdefault(row["metric"], []).append(row["value"])
+
+    ranks = {}
+    for metric in ACTIVITIES:
+        average = stats.get(metric + "_average")
+        if average is not None and metric in values:
+            ranks[metric] = min(bisect_left(values[metric], average), 100)
+    return ranks
+
+
+def histogram(db, metric):
+    """Returns a metric's histogram of per-user averages as a list of {"low", "high", "users"}"""
+
+    return db.execute("SELECT low, high, users FROM population_histogram WHERE metric = ? ORDER BY bin", metric)
+
+
+def histograms(db):
+    """Returns {metric: histogram(db, metric)} for every metric with population data, in one query"""
+
+    bins = {}
+    for row in db.execute("SELECT metric, low, high, users FROM population_histogram ORDER BY metric, bin"):
+        bins.setdefault(row.pop("metric"), []).append(row)
+    return bins
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+import sqlite3
+import threading
+import time
+
+
+class Database:
+    """
+    Drop-in replacement for cs50's SQL object built directly on sqlite3.
+
+    Each thread gets its own connection, opened in WAL mode so readers never
+    wait behind a writer, with synchronous=NORMAL and a prepared-statement
+    cache. execute() returns the same things cs50's did: a list of dicts for
+    queries, the new row's id for INSERT and the row count for UPDATE/DELETE.
+    """
+
+    def __init__(self, path, timeout=30, cached_statements=256):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+
+        # called as on_query(sql, seconds) after every statement, e.g. by instrumentation
+        self.on_query = None
+
+    def connect(self):
+        """Returns this thread's connection, opening it on first use"""
+
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.open()
+            self.local.connection = connection
+        return connection
+
+    def open(self):
+        """Opens a new connection with the database's settings"""
+
+        # isolation_level=None leaves transactions to BEGIN/COMMIT or transaction()
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                     check_same_thread=False, cached_statements=self.cached_statements)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def execute(self, sql, *args):
+        """Runs one statement and returns its result the way cs50's SQL.execute did"""
+
+        start = time.perf_counter()
+        cursor = self.connect().execute(sql, args)
+
+        # Statements that return rows (SELECT, WITH, PRAGMA ...)
+        if cursor.description is not None:
+            result = [dict(row) for row in cursor.fetchall()]
+        else:
+            command = sql.lstrip().split(None, 1)[0].upper()
+            if command in ["INSERT", "REPLACE"]:
+                result = cursor.lastrowid if cursor.rowcount == 1 else None
+            elif command in ["UPDATE", "DELETE"]:
+                result = cursor.rowcount
+            else:
+                result = True
+
+        if self.on_query:
+            self.on_query(sql, time.perf_counter() - start)
+        return result
+
+    def iterate(self, sql, *args, size=500):
+        """
+        Yields the rows of a query one at a time as dicts, fetching `size` at a
+        time, so memory use stays flat however many rows match. The query runs
+        on its own connection, which is closed when the generator finishes or
+        is closed early.
+        """
+
+        connection = self.open()
+        try:
+            cursor = connection.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            connection.close()
+
+    def executemany(self, sql, rows):
+        """Runs one statement for every tuple of parameters in rows and returns the row count"""
+
+        start = time.perf_counter()
+        count = self.connect().executemany(sql, rows).rowcount
+
+        if self.on_query:
+            self.on_query(sql, time.perf_counter() - start)
+        return count
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed statements as one transaction, committing at the end
+        or rolling back if an exception escapes. Nested uses join the outer one.
+        """
+
+        connection = self.connect()
+        if connection.in_transaction:
+            yield self
+            return
+
+        # take the write lock up front so the transaction can't fail halfway on a busy database
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+import multiprocessing
+import os
+import threading
+
+# The work factor new hashes are made with (werkzeug's own default); weaker hashes are upgraded at login
+DEFAULT_METHOD = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already waiting for a worker"""
+
+
+class PasswordHasher:
+    """
+    Runs password hashing in a small process pool so key derivation never ties
+    up the request threads. At most `max_pending` hashes may be queued or running;
+    past that, or if a hash waits longer than `timeout` seconds, HasherBusy is
+    raised so the request can be turned away instead of queueing forever.
+    A hash that timed out keeps its slot until it's cancelled or finishes, so
+    abandoned work still counts against `max_pending`.
+    With workers=0 hashing runs in the calling thread.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=8, workers=2, max_pending=8, timeout=10):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def executor(self):
+        """Returns this process's pool, starting it on first use (pools don't survive a fork)"""
+
+        with self.lock:
+            if self.pool is None or self.pool[0] != os.getpid():
+                pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self.pool = (os.getpid(), pool)
+            return self.pool[1]
+
+    def run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        if self.workers == 0:
+            try:
+                return function(*args)
+            finally:
+                self.slots.release()
+
+        try:
+            future = self.executor().submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        # the slot is freed when the work is done or cancelled, not when we stop waiting for it
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # still queued: drop it; already running: it keeps its slot until it finishes
+            future.cancel()
+            raise HasherBusy()
+
+    def hash(self, password):
+        """Hashes a password with the configured method"""
+
+        return self.run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, hash, password):
+        """Returns True if password matches hash"""
+
+        return self.run(check_password_hash, hash, password)
+
+    def needs_rehash(self, hash):
+        """
+        Returns True if hash is weaker than what's configured: a different method,
+        fewer pbkdf2 iterations or a shorter salt. Stronger hashes are left alone.
+        """
+
+        method, salt, _ = (hash.split("$", 2) + ["", ""])[:3]
+        if len(salt) < self.salt_length:
+            return True
+        if method == self.method:
+            return False
+
+        # the same pbkdf2 digest only needs redoing if the configured iteration count has gone up
+        stored, configured = method.split(":"), self.method.split(":")
+        if len(stored) == len(configured) == 3 and stored[:2] == configured[:2] and stored[2].isdigit() and configured[2].isdigit():
+            return int(stored[2]) < int(configured[2])
+        return True
@@ -0,0 +1,137 @@
+from flask import Response, abort, before_render_template, g, has_app_context, request, template_rendered
+import hmac
+import threading
+import time
+
+# Upper bounds (in seconds) of the request duration histogram buckets
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class Instrumentation:
+    """
+    Records, for every request, how many queries ran, the time spent in SQL,
+    in chart rendering and in templates, and the total time.
+
+    Each response reports its own numbers in a Server-Timing header, totals per
+    endpoint are served in Prometheus text format from /metrics, and queries
+    slower than slow_query_ms are logged as warnings. Totals are per process.
+
+    /metrics is only served when a metrics_token is given, and only to requests
+    sending it as "Authorization: Bearer <token>".
+    """
+
+    def __init__(self, app, db, chart_cache, slow_query_ms=100, server_timing=True, metrics_token=None):
+        self.app = app
+        self.slow_query = slow_query_ms / 1000
+        self.server_timing = server_timing
+        self.metrics_token = metrics_token
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.slow_queries = 0
+
+        db.on_query = self.record_query
+        chart_cache.on_render = self.record_render
+        before_render_template.connect(self.template_started, app)
+        template_rendered.connect(self.template_finished, app)
+        app.before_request(self.request_started)
+        app.after_request(self.request_finished)
+        if metrics_token:
+            app.add_url_rule("/metrics", "metrics", self.metrics)
+
+    def request_started(self):
+        g.timing = {"start": time.perf_counter(), "queries": 0, "sql": 0.0, "render": 0.0, "template": 0.0}
+
+    def record_query(self, sql, seconds):
+        if seconds >= self.slow_query:
+            with self.lock:
+                self.slow_queries += 1
+            self.app.logger.warning("slow query (%.1f ms): %s", seconds * 1000, " ".join(sql.split()))
+
+        if has_app_context() and "timing" in g:
+            g.timing["queries"] += 1
+            g.timing["sql"] += seconds
+
+    def record_render(self, seconds):
+        if has_app_context() and "timing" in g:
+            g.timing["render"] += seconds
+
+    def template_started(self, sender, template, context, **extra):
+        if "timing" in g:
+            g.timing["template_start"] = time.perf_counter()
+
+    def template_finished(self, sender, template, context, **extra):
+        if "timing" in g and "template_start" in g.timing:
+            g.timing["template"] += time.perf_counter() - g.timing.pop("template_start")
+
+    def request_finished(self, response):
+        timing = g.pop("timing", None)
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing["start"]
+
+        if self.server_timing:
+            response.headers["Server-Timing"] = ", ".join([
+                f'db;desc="{timing["queries"]} queries";dur={timing["sql"] * 1000:.2f}',
+                f'chart;dur={timing["render"] * 1000:.2f}',
+                f'tpl;dur={timing["template"] * 1000:.2f}',
+                f'total;dur={total * 1000:.2f}',
+            ])
+
+        # add this request to its endpoint's running totals
+        key = (request.endpoint or "none", request.method, str(response.status_code))
+        with self.lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = {"count": 0, "seconds": 0.0, "queries": 0, "sql": 0.0,
+                                             "render": 0.0, "template": 0.0, "buckets": [0] * len(BUCKETS)}
+            totals["count"] += 1
+            totals["seconds"] += total
+            totals["queries"] += timing["queries"]
+            totals["sql"] += timing["sql"]
+            totals["render"] += timing["render"]
+            totals["template"] += timing["template"]
+            for i, bound in enumerate(BUCKETS):
+                if total <= bound:
+                    totals["buckets"][i] += 1
+
+        return response
+
+    def metrics(self):
+        """Serves the running totals in Prometheus text format"""
+
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {self.metrics_token}".encode()):
+            abort(401)
+
+        with self.lock:
+            totals = {key: dict(value, buckets=list(value["buckets"])) for key, value in self.totals.items()}
+            slow_queries = self.slow_queries
+
+        lines = []
+
+        def family(name, kind, help, field):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (endpoint, method, status), value in sorted(totals.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}",method="{method}",status="{status}"}} {value[field]}')
+
+        family("downtime_requests_total", "counter", "Requests handled.", "count")
+        family("downtime_sql_queries_total", "counter", "SQL statements run while handling requests.", "queries")
+        family("downtime_sql_seconds_total", "counter", "Time spent running SQL.", "sql")
+        family("downtime_chart_render_seconds_total", "counter", "Time spent rendering charts with matplotlib.", "render")
+        family("downtime_template_seconds_total", "counter", "Time spent rendering templates.", "template")
+
+        lines.append("# HELP downtime_request_duration_seconds Time to handle a request.")
+        lines.append("# TYPE downtime_request_duration_seconds histogram")
+        for (endpoint, method, status), value in sorted(totals.items()):
+            labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+            for bound, count in zip(BUCKETS, value["buckets"]):
+                lines.append(f'downtime_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'downtime_request_duration_seconds_bucket{{{labels},le="+Inf"}} {value["count"]}')
+            lines.append(f"downtime_request_duration_seconds_sum{{{labels}}} {value['seconds']}")
+            lines.append(f"downtime_request_duration_seconds_count{{{labels}}} {value['count']}")
+
+        lines.append("# HELP downtime_slow_queries_total Queries slower than the slow query threshold.")
+        lines.append("# TYPE downtime_slow_queries_total counter")
+        lines.append(f"downtime_slow_queries_total {slow_queries}")
+
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,113 @@
+import datetime
+
+# Each migration is (version, name, statements). Migrations are applied in
+# order, once, and the applied versions are recorded in schema_migrations.
+# Only ever append to this list; never edit a migration that has shipped.
+# So migrations spell out their tables and SQL rather than using queries.py's
+# ACTIVITIES or PERIODS, which may change.
+MIGRATIONS = [
+    (1, "activity and goal indexes",
+        # keep only the newest row for each (user_id, date) before enforcing uniqueness
+        [f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY user_id, date)"
+            for table in ["sleep", "water", "exercise", "relaxation"]] +
+        [f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_user_date ON {table} (user_id, date)"
+            for table in ["sleep", "water", "exercise", "relaxation"]] +
+        ["CREATE INDEX IF NOT EXISTS goals_user_deleted_complete ON goals (user_id, deleted, complete)"]),
+    (2, "user_stats summary table",
+        # running count and sum of every metric, plus goal totals, kept up to date by the write handlers
+        ["CREATE TABLE user_stats (user_id INTEGER PRIMARY KEY, " +
+            "".join(f"{table}_count INTEGER NOT NULL DEFAULT 0, {table}_sum REAL NOT NULL DEFAULT 0, "
+                    for table in ["sleep", "water", "exercise", "relaxation"]) +
+            "goals_total INTEGER NOT NULL DEFAULT 0, goals_complete INTEGER NOT NULL DEFAULT 0, "
+            "goals_current_complete INTEGER NOT NULL DEFAULT 0, goals_current_incomplete INTEGER NOT NULL DEFAULT 0, "
+            "FOREIGN KEY (user_id) REFERENCES users(id))",
+         "INSERT INTO user_stats (user_id) SELECT id FROM users"] +
+        # backfill from the existing history
+        [f"UPDATE user_stats SET ({table}_count, {table}_sum) = "
+            f"(SELECT COUNT(amount), TOTAL(amount) FROM {table} WHERE {table}.user_id = user_stats.user_id)"
+            for table in ["sleep", "water", "exercise", "relaxation"]] +
+        ["UPDATE user_stats SET (goals_total, goals_complete, goals_current_complete, goals_current_incomplete) = "
+            "(SELECT COUNT(*), COALESCE(SUM(complete), 0), COALESCE(SUM(deleted = 0 AND complete = 1), 0), "
+            "COALESCE(SUM(deleted = 0 AND complete = 0), 0) FROM goals WHERE goals.user_id = user_stats.user_id)"]),
+    (3, "weekly and monthly rollups",
+        # sum/count/min/max of each metric per user per week (starting Monday) and month
+        ["CREATE TABLE rollups (user_id INTEGER NOT NULL, metric TEXT NOT NULL, period TEXT NOT NULL, start TEXT NOT NULL, "
+            "sum REAL NOT NULL, count INTEGER NOT NULL, min NUMERIC, max NUMERIC, "
+            "PRIMARY KEY (user_id, metric, period, start), FOREIGN KEY (user_id) REFERENCES users(id)) WITHOUT ROWID"] +
+        [f"INSERT INTO rollups (user_id, metric, period, start, sum, count, min, max) "
+            f"SELECT user_id, '{table}', '{period}', {start}, TOTAL(amount), COUNT(amount), MIN(amount), MAX(amount) "
+            f"FROM {table} WHERE date(date) IS NOT NULL GROUP BY user_id, {start}"
+            for table in ["sleep", "water", "exercise", "relaxation"]
+            for period, start in [("week", "date(date, 'weekday 0', '-6 days')"), ("month", "substr(date, 1, 7) || '-01'")]]),
+    (4, "user data versions",
+        # bumped by every write so unchanged pages can be answered with 304 Not Modified
+        ["ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0",
+         "ALTER TABLE users ADD COLUMN data_modified INTEGER NOT NULL DEFAULT 0"]),
+    (5, "recommendations",
+        # each user's rolling averages and attainment per activity, precomputed for /recommendations
+        ["CREATE TABLE recommendations (user_id INTEGER NOT NULL, metric TEXT NOT NULL, target REAL NOT NULL, "
+            "average_7 REAL, average_30 REAL, days_30 INTEGER NOT NULL, attainment REAL, deficit REAL, updated TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, metric), FOREIGN KEY (user_id) REFERENCES users(id)) WITHOUT ROWID"] +
+        # backfill, with the targets as they were when this shipped (later changes go through refresh-recommendations)
+        [f"INSERT INTO recommendations (user_id, metric, target, average_7, average_30, days_30, attainment, deficit, updated) "
+            f"SELECT user_id, '{table}', {target}, average_7, average_30, days_30, met_30 / NULLIF(days_30, 0), "
+            f"MAX(0, {target} - average_7), date('now', 'localtime') FROM ("
+            f"SELECT users.id AS user_id, AVG(CASE WHEN {table}.date >= date('now', 'localtime', '-6 days') THEN amount END) AS average_7, "
+            f"AVG(amount) AS average_30, COUNT(amount) AS days_30, TOTAL(amount >= {target}) AS met_30 "
+            f"FROM users LEFT JOIN {table} ON {table}.user_id = users.id "
+            f"AND {table}.date BETWEEN date('now', 'localtime', '-29 days') AND date('now', 'localtime') "
+            f"GROUP BY users.id)"
+            for table, target in [("sleep", 8), ("water", 2), ("exercise", 30), ("relaxation", 30)]]),
+    (6, "population statistics",
+        # percentiles and histograms of all users' averages, written by the population-stats batch job
+        ["CREATE TABLE population_percentiles (metric TEXT NOT NULL, percentile INTEGER NOT NULL, value REAL NOT NULL, "
+            "PRIMARY KEY (metric, percentile)) WITHOUT ROWID",
+         "CREATE TABLE population_histogram (metric TEXT NOT NULL, bin INTEGER NOT NULL, low REAL NOT NULL, high REAL NOT NULL, "
+            "users INTEGER NOT NULL, PRIMARY KEY (metric, bin)) WITHOUT ROWID"]),
+    (7, "remove non-numeric amounts",
+        # the original app stored a blank amount on a new date as '', which always meant "no entry";
+        # averages counted those rows as 0 while comparisons with a target counted them as met
+        [f"DELETE FROM {table} WHERE typeof(amount) NOT IN ('integer', 'real')"
+            for table in ["sleep", "water", "exercise", "relaxation"]] +
+        # then everything computed from the activity tables is recomputed: user_stats ...
+        [f"UPDATE user_stats SET ({table}_count, {table}_sum) = "
+            f"(SELECT COUNT(amount), TOTAL(amount) FROM {table} WHERE {table}.user_id = user_stats.user_id)"
+            for table in ["sleep", "water", "exercise", "relaxation"]] +
+        # ... the rollups ...
+        ["DELETE FROM rollups"] +
+        [f"INSERT INTO rollups (user_id, metric, period, start, sum, count, min, max) "
+            f"SELECT user_id, '{table}', '{period}', {start}, TOTAL(amount), COUNT(amount), MIN(amount), MAX(amount) "
+            f"FROM {table} WHERE date(date) IS NOT NULL GROUP BY user_id, {start}"
+            for table in ["sleep", "water", "exercise", "relaxation"]
+            for period, start in [("week", "date(date, 'weekday 0', '-6 days')"), ("month", "substr(date, 1, 7) || '-01'")]] +
+        # ... and the recommendations, with the targets as they were when this shipped
+        ["DELETE FROM recommendations"] +
+        [f"INSERT INTO recommendations (user_id, metric, target, average_7, average_30, days_30, attainment, deficit, updated) "
+            f"SELECT user_id, '{table}', {target}, average_7, average_30, days_30, met_30 / NULLIF(days_30, 0), "
+            f"MAX(0, {target} - average_7), date('now', 'localtime') FROM ("
+            f"SELECT users.id AS user_id, AVG(CASE WHEN {table}.date >= date('now', 'localtime', '-6 days') THEN amount END) AS average_7, "
+            f"AVG(amount) AS average_30, COUNT(amount) AS days_30, TOTAL(amount >= {target}) AS met_30 "
+            f"FROM users LEFT JOIN {table} ON {table}.user_id = users.id "
+            f"AND {table}.date BETWEEN date('now', 'localtime', '-29 days') AND date('now', 'localtime') "
+            f"GROUP BY users.id)"
+            for table, target in [("sleep", 8), ("water", 2), ("exercise", 30), ("relaxation", 30)]] +
+        # pages cached by data version show these numbers
+        ["UPDATE users SET data_version = data_version + 1, data_modified = CAST(strftime('%s', 'now') AS INTEGER)"]),
+]
+
+
+def migrate(db):
+    """Applies any migrations that haven't been run against the database yet"""
+
+    db.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied TEXT NOT NULL)")
+
+    for version, name, statements in MIGRATIONS:
+
+        # run each migration in its own transaction so a failure leaves the schema untouched,
+        # and take the write lock first so workers starting together don't both apply it
+        with db.transaction():
+            if not db.execute("SELECT version FROM schema_migrations WHERE version = ?", version):
+                for statement in statements:
+                    db.execute(statement)
+                db.execute("INSERT INTO schema_migrations (version, name, applied) VALUES(?, ?, ?)",
+                           version, name, str(datetime.datetime.now())[:19])
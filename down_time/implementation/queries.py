@@ -0,0 +1,316 @@
+import datetime
+
+# The four activity tables share the same (id, user_id, amount, date) layout
+ACTIVITIES = ["sleep", "water", "exercise", "relaxation"]
+
+# Rollup periods, and the SQL for the first day of the period a row's date falls in
+PERIODS = {
+    "week": "date(date, 'weekday 0', '-6 days')",
+    "month": "substr(date, 1, 7) || '-01'",
+}
+
+# Ranges the activities page can show: (granularity, how many)
+RANGES = {"7d": ("day", 7), "30d": ("day", 30), "12w": ("week", 12), "12m": ("month", 12)}
+
+
+def last_dates(days=7):
+    """Returns the dates of the last `days` days (oldest first) as YYYY-MM-DD strings"""
+
+    today = datetime.datetime.now()
+    dates = []
+
+    for i in range(days):
+        delta = datetime.timedelta(days=(days - 1 - i))
+        rawdate = str(today - delta)[:10]
+        dates.append(rawdate)
+
+    return dates
+
+
+def period_bounds(period, date):
+    """Returns the first and last dates of the week (Monday-Sunday) or month containing date"""
+
+    day = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    if period == "week":
+        start = day - datetime.timedelta(days=day.weekday())
+        end = start + datetime.timedelta(days=6)
+    else:
+        start = day.replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    return str(start), str(end)
+
+
+def last_periods(period, count):
+    """Returns the first dates of the last `count` weeks or months (oldest first), including the current one"""
+
+    starts = [period_bounds(period, last_dates(1)[0])[0]]
+    while len(starts) < count:
+        previous = datetime.datetime.strptime(starts[0], '%Y-%m-%d').date() - datetime.timedelta(days=1)
+        starts.insert(0, period_bounds(period, str(previous))[0])
+    return starts
+
+
+def activity_window(db, user_id, dates, metrics=ACTIVITIES):
+    """
+    Returns {metric: [amount for each date]} for the given dates.
+
+    All metrics are read with a single UNION ALL query over the date range,
+    and days without an entry are filled in with 0.
+    """
+
+    # one grouped SELECT per table, glued together so the database is only hit once
+    selects = []
+    args = []
+    for metric in metrics:
+        if metric not in ACTIVITIES:
+            raise ValueError("unknown activity: " + metric)
+        selects.append(f"SELECT '{metric}' AS metric, date, AVG(amount) AS amount FROM {metric} "
+                       "WHERE user_id = ? AND date BETWEEN ? AND ? GROUP BY date")
+        args += [user_id, dates[0], dates[-1]]
+
+    rows = db.execute(" UNION ALL ".join(selects), *args)
+
+    # fill in the missing days with 0 so every graph has a bar per date
+    found = {(row["metric"], row["date"]): row["amount"] for row in rows}
+    amounts = {}
+    for metric in metrics:
+        amounts[metric] = []
+        for date in dates:
+            amount = found.get((metric, date))
+            if amount == None:
+                amount = 0
+            amounts[metric].append(amount)
+
+    return amounts
+
+
+def activity_range(db, user_id, span, metrics=ACTIVITIES):
+    """
+    Returns (labels, {metric: [amount per label]}, title) for one of RANGES.
+
+    Day ranges come from the activity tables; week and month ranges come from
+    the rollups table (average per logged day), so every range is one query.
+    """
+
+    period, count = RANGES[span]
+    if period == "day":
+        dates = last_dates(count)
+        return dates, activity_window(db, user_id, dates, metrics), f"Timeline: Last {count} Days"
+
+    starts = last_periods(period, count)
+    placeholders = ", ".join("?" for metric in metrics)
+    rows = db.execute(f"SELECT metric, start, sum, count FROM rollups WHERE user_id = ? AND period = ? "
+                      f"AND start >= ? AND metric IN ({placeholders})", user_id, period, starts[0], *metrics)
+
+    found = {(row["metric"], row["start"]): row["sum"] / row["count"] for row in rows if row["count"]}
+    amounts = {metric: [round(found.get((metric, start), 0), 2) for start in starts] for metric in metrics}
+
+    if period == "week":
+        return starts, amounts, f"Timeline: Last {count} Weeks (daily average)"
+    return [start[:7] for start in starts], amounts, f"Timeline: Last {count} Months (daily average)"
+
+
+def save_activity(db, user_id, metric, date, amount):
+    """
+    Sets the user's amount for a metric on a date, or deletes it if amount is blank.
+
+    Relies on the UNIQUE (user_id, date) index, so each write (and the matching
+    user_stats update) costs the same no matter how much history the user has.
+    """
+
+    if metric not in ACTIVITIES:
+        raise ValueError("unknown activity: " + metric)
+
+    # the day's entry counted the same way rebuild_stats() counts the whole table
+    day = f"SELECT COUNT(amount) AS count, TOTAL(amount) AS sum FROM {metric} WHERE user_id = ? AND date = ?"
+
+    with db.transaction():
+        # the entry being replaced, if any, so its amount can come out of the running totals
+        old = db.execute(day, user_id, date)[0]
+
+        if amount == "" or amount == None:
+            db.execute(f"DELETE FROM {metric} WHERE user_id = ? AND date = ?", user_id, date)
+        else:
+            db.execute(f"INSERT INTO {metric} (user_id, amount, date) VALUES(?, ?, ?) "
+                       "ON CONFLICT(user_id, date) DO UPDATE SET amount = excluded.amount",
+                       user_id, amount, date)
+
+        # read back what was stored rather than trusting float(amount), so the totals always match the table
+        new = db.execute(day, user_id, date)[0]
+
+        ensure_stats(db, user_id)
+        db.execute(f"UPDATE user_stats SET {metric}_count = {metric}_count + ?, {metric}_sum = {metric}_sum + ? WHERE user_id = ?",
+                   new["count"] - old["count"], new["sum"] - old["sum"], user_id)
+        refresh_rollups(db, user_id, metric, [date])
+
+
+def save_activities(db, user_id, entries):
+    """
+    Saves many (metric, date, amount) entries in one transaction, the same way
+    save_activity() saves one: a blank amount deletes that day's entry. If a
+    date appears more than once for a metric, the last entry wins.
+    """
+
+    # the last entry for each (metric, date), split into upserts and deletes per metric
+    latest = {}
+    for metric, date, amount in entries:
+        if metric not in ACTIVITIES:
+            raise ValueError("unknown activity: " + metric)
+        latest[(metric, date)] = amount
+
+    with db.transaction():
+        for metric in ACTIVITIES:
+            upserts = [(user_id, amount, date) for (m, date), amount in latest.items()
+                       if m == metric and amount != "" and amount != None]
+            deletes = [(user_id, date) for (m, date), amount in latest.items()
+                       if m == metric and (amount == "" or amount == None)]
+            if not upserts and not deletes:
+                continue
+
+            if upserts:
+                db.executemany(f"INSERT INTO {metric} (user_id, amount, date) VALUES(?, ?, ?) "
+                               "ON CONFLICT(user_id, date) DO UPDATE SET amount = excluded.amount", upserts)
+            if deletes:
+                db.executemany(f"DELETE FROM {metric} WHERE user_id = ? AND date = ?", deletes)
+
+            # one recount per metric touched is cheaper than adjusting the totals entry by entry
+            ensure_stats(db, user_id)
+            db.execute(f"UPDATE user_stats SET ({metric}_count, {metric}_sum) = "
+                       f"(SELECT COUNT(amount), TOTAL(amount) FROM {metric} WHERE user_id = ?) WHERE user_id = ?",
+                       user_id, user_id)
+            refresh_rollups(db, user_id, metric, [date for m, date in latest if m == metric])
+
+    return len(latest)
+
+
+def refresh_rollups(db, user_id, metric, dates):
+    """Recomputes the weekly and monthly rollups of a metric that contain any of the given dates"""
+
+    buckets = {(period,) + period_bounds(period, date) for date in dates for period in PERIODS}
+
+    # each bucket is at most a month of rows, read through the (user_id, date) index
+    db.executemany(f"INSERT INTO rollups (user_id, metric, period, start, sum, count, min, max) "
+                   f"SELECT ?, ?, ?, ?, TOTAL(amount), COUNT(amount), MIN(amount), MAX(amount) FROM {metric} "
+                   "WHERE user_id = ? AND date BETWEEN ? AND ? "
+                   "ON CONFLICT(user_id, metric, period, start) DO UPDATE SET "
+                   "sum = excluded.sum, count = excluded.count, min = excluded.min, max = excluded.max",
+                   [(user_id, metric, period, start, user_id, start, end) for period, start, end in buckets])
+    db.execute("DELETE FROM rollups WHERE user_id = ? AND metric = ? AND count = 0", user_id, metric)
+
+
+def rebuild_rollups(db):
+    """Recomputes every rollup from the activity tables (for bulk-loaded data or an offline backfill)"""
+
+    with db.transaction():
+        db.execute("DELETE FROM rollups")
+        for metric in ACTIVITIES:
+            for period, start in PERIODS.items():
+                db.execute(f"INSERT INTO rollups (user_id, metric, period, start, sum, count, min, max) "
+                           f"SELECT user_id, '{metric}', '{period}', {start}, TOTAL(amount), COUNT(amount), MIN(amount), MAX(amount) "
+                           f"FROM {metric} WHERE date(date) IS NOT NULL GROUP BY user_id, {start}")
+
+
+def bump_data_version(db, user_id=None):
+    """
+    Moves a user's data version on (everyone's if user_id is None), which makes
+    every ETag handed out for their pages stale.
+    """
+
+    sql = "UPDATE users SET data_version = data_version + 1, data_modified = CAST(strftime('%s', 'now') AS INTEGER)"
+    if user_id is None:
+        db.execute(sql)
+    else:
+        db.execute(sql + " WHERE id = ?", user_id)
+
+
+def ensure_stats(db, user_id):
+    """Makes sure the user has a row in user_stats"""
+
+    db.execute("INSERT INTO user_stats (user_id) VALUES(?) ON CONFLICT(user_id) DO NOTHING", user_id)
+
+
+def refresh_goal_stats(db, user_id):
+    """Recounts the user's goal totals in user_stats after one of their goals changes"""
+
+    ensure_stats(db, user_id)
+    db.execute("UPDATE user_stats SET (goals_total, goals_complete, goals_current_complete, goals_current_incomplete) = "
+               "(SELECT COUNT(*), COALESCE(SUM(complete), 0), COALESCE(SUM(deleted = 0 AND complete = 1), 0), "
+               "COALESCE(SUM(deleted = 0 AND complete = 0), 0) FROM goals WHERE user_id = ?) WHERE user_id = ?",
+               user_id, user_id)
+
+
+def rebuild_stats(db):
+    """Recomputes every user's user_stats row from scratch (for bulk-loaded data)"""
+
+    with db.transaction():
+        db.execute("INSERT INTO user_stats (user_id) SELECT id FROM users WHERE true ON CONFLICT(user_id) DO NOTHING")
+        for metric in ACTIVITIES:
+            db.execute(f"UPDATE user_stats SET ({metric}_count, {metric}_sum) = "
+                       f"(SELECT COUNT(amount), TOTAL(amount) FROM {metric} WHERE {metric}.user_id = user_stats.user_id)")
+        db.execute("UPDATE user_stats SET (goals_total, goals_complete, goals_current_complete, goals_current_incomplete) = "
+                   "(SELECT COUNT(*), COALESCE(SUM(complete), 0), COALESCE(SUM(deleted = 0 AND complete = 1), 0), "
+                   "COALESCE(SUM(deleted = 0 AND complete = 0), 0) FROM goals WHERE goals.user_id = user_stats.user_id)")
+
+
+def user_stats(db, user_id):
+    """
+    Returns the user's summary numbers: goal totals and each metric's overall
+    average (None if nothing has been logged), read from one user_stats row.
+    """
+
+    rows = db.execute("SELECT * FROM user_stats WHERE user_id = ?", user_id)
+    row = rows[0] if rows else {}
+
+    stats = {}
+    for key in ["goals_total", "goals_complete", "goals_current_complete", "goals_current_incomplete"]:
+        stats[key] = row.get(key, 0)
+
+    for metric in ACTIVITIES:
+        if row.get(metric + "_count"):
+            stats[metric + "_average"] = round(row[metric + "_sum"] / row[metric + "_count"], 2)
+        else:
+            stats[metric + "_average"] = None
+
+    return stats
+
+
+def activity_history(db, user_id, metrics=ACTIVITIES, since=None, before=None, limit=50):
+    """
+    Returns one page of entries per metric, newest first, in one query:
+    {metric: {"rows": [{"amount", "date"} ...], "next": cursor}}
+
+    Pages are keyset-paginated on date through the (user_id, date) index.
+    Only entries on or after `since` are included, and `before` is the cursor
+    returned with the previous page (None once there are no older entries).
+    """
+
+    # the newest limit + 1 entries of each metric; the extra row tells us if there's another page
+    selects = []
+    args = []
+    for metric in metrics:
+        if metric not in ACTIVITIES:
+            raise ValueError("unknown activity: " + metric)
+
+        where = "user_id = ?"
+        args.append(user_id)
+        if since:
+            where += " AND date >= ?"
+            args.append(since)
+        if before:
+            where += " AND date < ?"
+            args.append(before)
+        selects.append(f"SELECT * FROM (SELECT '{metric}' AS metric, amount, date FROM {metric} "
+                       f"WHERE {where} ORDER BY date DESC LIMIT ?)")
+        args.append(limit + 1)
+
+    history = {metric: {"rows": [], "next": None} for metric in metrics}
+    for row in db.execute(" UNION ALL ".join(selects), *args):
+        history[row["metric"]]["rows"].append({"amount": row["amount"], "date": row["date"]})
+
+    for page in history.values():
+        page["rows"].sort(key=lambda row: row["date"], reverse=True)
+        if len(page["rows"]) > limit:
+            del page["rows"][limit:]
+            page["next"] = page["rows"][-1]["date"]
+
+    return history
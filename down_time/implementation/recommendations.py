@@ -0,0 +1,71 @@
+from queries import ACTIVITIES, bump_data_version
+
+# Daily targets for each activity, in the units it's logged in
+TARGETS = {
+    "sleep": {"target": 8, "unit": "hours"},
+    "water": {"target": 2, "unit": "liters"},
+    "exercise": {"target": 30, "unit": "minutes"},
+    "relaxation": {"target": 30, "unit": "minutes"},
+}
+
+# Suggestions shown when a user is falling short of an activity's target
+TIPS = {
+    "sleep": "Try going to bed at the same time every night, and put screens away half an hour before.",
+    "water": "Keep a bottle on your desk and refill it every time it's empty.",
+    "exercise": "A brisk walk at lunch counts: two 15 minute walks get you to the target.",
+    "relaxation": "Block out time for yourself in your calendar, like any other appointment.",
+}
+
+
+def refresh_sql(metric, where):
+    """
+    Returns the statement that recomputes the metric's recommendation row for
+    every user matching `where`, from the user's last 30 days of entries:
+      - the average over the logged days of the last 7 and 30 days
+      - how many days of the last 30 were logged, and the share of those that met the target
+      - how far the 7 day average falls short of the target (0 if it doesn't)
+    """
+
+    target = TARGETS[metric]["target"]
+    return (f"INSERT INTO recommendations (user_id, metric, target, average_7, average_30, days_30, attainment, deficit, updated) "
+            f"SELECT user_id, '{metric}', {target}, average_7, average_30, days_30, met_30 / NULLIF(days_30, 0), "
+            f"MAX(0, {target} - average_7), date('now', 'localtime') FROM ("
+            f"SELECT users.id AS user_id, AVG(CASE WHEN {metric}.date >= date('now', 'localtime', '-6 days') THEN amount END) AS average_7, "
+            f"AVG(amount) AS average_30, COUNT(amount) AS days_30, TOTAL(amount >= {target}) AS met_30 "
+            f"FROM users LEFT JOIN {metric} ON {metric}.user_id = users.id "
+            f"AND {metric}.date BETWEEN date('now', 'localtime', '-29 days') AND date('now', 'localtime') "
+            f"WHERE {where} GROUP BY users.id) WHERE true "
+            "ON CONFLICT(user_id, metric) DO UPDATE SET target = excluded.target, average_7 = excluded.average_7, "
+            "average_30 = excluded.average_30, days_30 = excluded.days_30, attainment = excluded.attainment, "
+            "deficit = excluded.deficit, updated = excluded.updated")
+
+
+def refresh_recommendations(db, user_id, metrics=ACTIVITIES):
+    """Recomputes a user's recommendations for the given metrics after they log data"""
+
+    with db.transaction():
+        for metric in metrics:
+            db.execute(refresh_sql(metric, "users.id = ?"), user_id)
+
+
+def rebuild_recommendations(db):
+    """
+    Recomputes everyone's recommendations. Run daily (flask refresh-recommendations)
+    so the rolling averages move on for users who haven't logged anything since.
+    """
+
+    with db.transaction():
+        for metric in ACTIVITIES:
+            db.execute(refresh_sql(metric, "true"))
+        bump_data_version(db)
+
+
+def recommendations(db, user_id):
+    """Returns the user's precomputed recommendations in ACTIVITIES order, with each metric's unit and tip"""
+
+    rows = db.execute("SELECT * FROM recommendations WHERE user_id = ?", user_id)
+    rows.sort(key=lambda row: ACTIVITIES.index(row["metric"]))
+    for row in rows:
+        row["unit"] = TARGETS[row["metric"]]["unit"]
+        row["tip"] = TIPS[row["metric"]]
+    return rows
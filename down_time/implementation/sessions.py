@@ -0,0 +1,148 @@
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+import os
+import secrets
+import threading
+import time
+
+from database import Database
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    """Server-side session whose data lives in a row of the sessions table"""
+
+    def __init__(self, initial=None, sid=None, expires=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    Stores sessions in a SQLite database in WAL mode, so session reads never
+    block behind writes and any worker process on the same host can serve a user.
+    WAL doesn't work over a network filesystem, so the file can't be shared
+    between hosts; use the cookie backend to serve from more than one host.
+
+    Sessions expire `ttl` seconds after they were last saved, and expired rows
+    are purged by a background thread every `purge_interval` seconds.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path, ttl=86400, purge_interval=600):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.db = Database(path)
+        self.purger = None
+
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def start_purger(self):
+        """Starts the purge thread in this process (threads don't survive a fork)"""
+
+        if self.purger is not None and self.purger[0] == os.getpid():
+            return
+
+        thread = threading.Thread(target=self.purge_forever, daemon=True)
+        self.purger = (os.getpid(), thread)
+        thread.start()
+
+    def purge_forever(self):
+        while True:
+            time.sleep(self.purge_interval)
+            self.purge()
+
+    def purge(self):
+        """Deletes every expired session"""
+
+        self.db.execute("DELETE FROM sessions WHERE expires <= ?", time.time())
+
+    def open_session(self, app, request):
+        self.start_purger()
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            rows = self.db.execute("SELECT data, expires FROM sessions WHERE id = ? AND expires > ?", sid, time.time())
+            if len(rows) == 1:
+                return SqliteSession(self.serializer.loads(rows[0]["data"]), sid, rows[0]["expires"])
+
+        return SqliteSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        """Moves the session to a new id, deleting the row stored under the old one"""
+
+        self.db.execute("DELETE FROM sessions WHERE id = ?", session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # An emptied session (e.g. after logout) is deleted along with its cookie
+        if not session:
+            if session.modified:
+                self.db.execute("DELETE FROM sessions WHERE id = ?", session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Only write when the data changed or the expiry is more than halfway used up
+        now = time.time()
+        if session.modified or session.expires is None or session.expires - now < self.ttl / 2:
+            self.db.execute("INSERT INTO sessions (id, data, expires) VALUES(?, ?, ?) "
+                            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+                            session.sid, self.serializer.dumps(dict(session)), now + self.ttl)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def regenerate_session(app, session):
+    """
+    Gives the session a new id when the user logs in, so an id planted before
+    login (such as an attacker's own session cookie) never becomes the user's
+    authenticated session. Signed cookie sessions have no id to keep; their
+    whole cookie is rewritten anyway.
+    """
+
+    regenerate = getattr(app.session_interface, "regenerate", None)
+    if regenerate is not None:
+        regenerate(session)
+
+
+def configure_sessions(app):
+    """Sets up the session store named by SESSION_BACKEND: sqlite, cookie or filesystem"""
+
+    backend = app.config["SESSION_BACKEND"]
+
+    # Server-side sessions in SQLite (the default)
+    if backend == "sqlite":
+        app.session_interface = SqliteSessionInterface(app.config["SESSION_DB"], app.config["SESSION_TTL"])
+
+    # Stateless signed cookies; every worker and host must share SECRET_KEY
+    elif backend == "cookie":
+        if not app.config.get("SECRET_KEY"):
+            raise RuntimeError("SESSION_BACKEND=cookie requires SECRET_KEY to be set")
+
+    # Flask-Session's filesystem store, as the app originally used
+    elif backend == "filesystem":
+        from flask_session import Session
+
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+
+    else:
+        raise RuntimeError("unknown SESSION_BACKEND: " + backend)
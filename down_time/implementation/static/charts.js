@@ -0,0 +1,60 @@
+// Draws the graphs for pages rendered in client chart mode.
+// Every <canvas data-series="..."> is filled in from /api/series/<metric>.
+document.addEventListener('DOMContentLoaded', function() {
+    var canvases = document.querySelectorAll('canvas[data-series]');
+
+    canvases.forEach(function(canvas) {
+        var metric = canvas.dataset.series;
+        var url = '/api/series/' + metric;
+        if (canvas.dataset.range) {
+            url += '?range=' + encodeURIComponent(canvas.dataset.range);
+        }
+        else if (canvas.dataset.days) {
+            url += '?days=' + canvas.dataset.days;
+        }
+
+        fetch(url, {credentials: 'same-origin'})
+            .then(function(response) { return response.json(); })
+            .then(function(series) {
+                if (metric === 'goals') {
+                    drawPie(canvas, series);
+                }
+                else {
+                    drawBars(canvas, series);
+                }
+            });
+    });
+
+    // Bar graph of a metric over time, matching the matplotlib version
+    function drawBars(canvas, series) {
+        new Chart(canvas, {
+            type: 'bar',
+            data: {
+                labels: series.dates,
+                datasets: [{data: series.amounts, backgroundColor: series.color || '#1f77b4'}]
+            },
+            options: {
+                plugins: {legend: {display: false}, title: {display: true, text: series.title}},
+                scales: {
+                    x: {title: {display: true, text: 'Date'}},
+                    y: {title: {display: true, text: series.ylabel}, beginAtZero: true}
+                }
+            }
+        });
+    }
+
+    // Pie chart of complete vs incomplete goals
+    function drawPie(canvas, series) {
+        var total = series.sizes[0] + series.sizes[1];
+        new Chart(canvas, {
+            type: 'pie',
+            data: {
+                labels: total ? series.labels : ['No Current Goals'],
+                datasets: [{data: total ? series.sizes : [1], backgroundColor: total ? ['#1f77b4', '#ff7f0e'] : ['#1f77b4']}]
+            },
+            options: {
+                plugins: {title: {display: true, text: total ? 'Current Goal Completion Rate (excluding deleted goals)' : 'No Current Goals'}}
+            }
+        });
+    }
+});
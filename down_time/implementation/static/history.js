@@ -0,0 +1,35 @@
+// Loads older pages of the analytics history tables from /api/history/<metric>
+document.addEventListener('DOMContentLoaded', function() {
+    var window_select = document.getElementById('window');
+
+    document.querySelectorAll('button.load-older').forEach(function(button) {
+        button.addEventListener('click', function() {
+            var metric = button.dataset.metric;
+            var url = '/api/history/' + metric + '?window=' + encodeURIComponent(window_select.value) +
+                      '&before=' + encodeURIComponent(button.dataset.next);
+
+            button.disabled = true;
+            fetch(url, {credentials: 'same-origin'})
+                .then(function(response) { return response.json(); })
+                .then(function(page) {
+                    var tbody = document.getElementById('history-' + metric);
+
+                    // Add each entry as a new row at the bottom of the table
+                    page.rows.forEach(function(entry) {
+                        var row = tbody.insertRow();
+                        row.insertCell().textContent = entry.date;
+                        row.insertCell().textContent = entry.amount;
+                    });
+
+                    // Hide the button once the oldest entry has been shown
+                    if (page.next) {
+                        button.dataset.next = page.next;
+                        button.disabled = false;
+                    }
+                    else {
+                        button.remove();
+                    }
+                });
+        });
+    });
+});
@@ -0,0 +1,40 @@
+"""
+Downloads the third-party scripts the pages use into static/, at pinned
+versions, so they're served (and fingerprinted by build_static.py) like the
+app's own files instead of being loaded from a CDN. Commit the files it writes.
+
+Run from the implementation directory:
+
+    python vendor.py
+"""
+import base64
+import hashlib
+import os
+import urllib.request
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# File in static/ -> where to get it
+VENDOR = {
+    "chart.umd.min.js": "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.min.js",
+}
+
+
+def fetch(name, url):
+    """Downloads url to static/name and returns its SRI hash"""
+
+    with urllib.request.urlopen(url) as response:
+        data = response.read()
+
+    path = os.path.join(STATIC, name)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    return "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode()
+
+
+if __name__ == "__main__":
+    for name, url in VENDOR.items():
+        print(f"{name}: {fetch(name, url)}")
@@ -0,0 +1,236 @@
+"""
+Loads the Spotify decade datasets from a memory-mapped columnar cache.
+
+The first load parses the six raw_kaggle_data/dataset-of-XXs.csv files, adds the
+decade column, and writes each column as its own .npy file under cache/:
+  - audio features as float32
+  - key, mode, time_signature and target as int8, and decade as int16
+  - track, artist and uri dictionary-encoded: int32 codes per row, plus each distinct
+    value once, as UTF-8 bytes in one array with an array of offsets into it
+The train/test split is stored too. It is the same 80/20 split the notebook makes
+with train_test_split(random_state=109).
+
+Later loads memory-map those files, so they take milliseconds and processes
+loading the same cache share its pages. The cache is rebuilt when a raw CSV's
+SHA-256 changes (or its size or modification time does and the hash turns out different).
+
+    from loader import load
+    data = load()
+    train, test = data.split()              # pandas DataFrames, like spotify_train.csv/spotify_test.csv
+    X = data.matrix(NUMERIC_PREDS, data.train)
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RAW_DIR = os.path.join(HERE, "raw_kaggle_data")
+CACHE_DIR = os.path.join(HERE, "cache")
+
+# Bump when the cache layout changes so old caches get rebuilt
+VERSION = 1
+
+DECADES = {1960: "60s", 1970: "70s", 1980: "80s", 1990: "90s", 2000: "00s", 2010: "10s"}
+
+# Column types in the cache
+STRINGS = ["track", "artist", "uri"]
+INT8 = ["key", "mode", "time_signature", "target"]
+FLOAT32 = ["danceability", "energy", "loudness", "speechiness", "acousticness", "instrumentalness",
+           "liveness", "valence", "tempo", "duration_ms", "chorus_hit", "sections"]
+
+# The predictors the notebook's models use
+NUMERIC_PREDS = ["danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness", "instrumentalness",
+                 "liveness", "valence", "tempo", "duration_ms", "time_signature", "chorus_hit", "sections", "decade"]
+
+# The notebook's train/test split
+TRAIN_SIZE = 0.8
+RANDOM_STATE = 109
+
+
+def raw_files(raw_dir=RAW_DIR):
+    """Returns {decade: path} for the raw CSVs, oldest decade first"""
+
+    return {decade: os.path.join(raw_dir, f"dataset-of-{suffix}.csv") for decade, suffix in DECADES.items()}
+
+
+def sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Dataset:
+    """The cached columns (read-only memory maps) plus the train/test row indices"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.checksum = manifest["checksum"]
+
+        def array(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+        self.columns = {name: array(name) for name in FLOAT32 + INT8 + ["decade"]}
+        self.codes = {name: array(name + ".codes") for name in STRINGS}
+        self.blobs = {name: array(name + ".blob") for name in STRINGS}
+        self.offsets = {name: array(name + ".offsets") for name in STRINGS}
+
+        # zero-copy views of the blobs for slicing out single values
+        self.views = {name: memoryview(self.blobs[name]) for name in STRINGS}
+        self.train = array("train")
+        self.test = array("test")
+
+    def __len__(self):
+        return len(self.columns["target"])
+
+    def matrix(self, features=NUMERIC_PREDS, rows=None):
+        """Returns the given features as a float32 (rows x features) array"""
+
+        rows = slice(None) if rows is None else rows
+        return np.column_stack([self.columns[name][rows] for name in features]).astype(np.float32)
+
+    def target(self, rows=None):
+        rows = slice(None) if rows is None else rows
+        return np.asarray(self.columns["target"][rows])
+
+    def strings(self, name, rows=None):
+        """Decodes a dictionary-encoded column (track, artist or uri) for the given rows"""
+
+        rows = slice(None) if rows is None else rows
+        view, offsets = self.views[name], self.offsets[name]
+        codes = np.asarray(self.codes[name][rows])
+
+        # decode each distinct value once, straight from the memory map
+        distinct, inverse = np.unique(codes, return_inverse=True)
+        starts, ends = offsets[distinct].tolist(), offsets[distinct + 1].tolist()
+        decoded = np.array([str(view[start:end], "utf-8") for start, end in zip(starts, ends)], dtype=object)
+        return decoded[inverse]
+
+    def frame(self, rows=None):
+        """Returns rows (all by default) as a DataFrame with the same columns as the notebook's combined df"""
+
+        rows = slice(None) if rows is None else rows
+        data = {name: self.strings(name, rows) for name in STRINGS}
+        for name in ["danceability", "energy", "key", "loudness", "mode", "speechiness", "acousticness",
+                     "instrumentalness", "liveness", "valence", "tempo", "duration_ms", "time_signature",
+                     "chorus_hit", "sections", "target", "decade"]:
+            data[name] = self.columns[name][rows]
+        return pd.DataFrame(data)
+
+    def split(self):
+        """Returns the (train, test) DataFrames of the stored split"""
+
+        return self.frame(self.train), self.frame(self.test)
+
+
+def load(cache_dir=CACHE_DIR, raw_dir=RAW_DIR):
+    """Returns the Dataset, building or rebuilding the cache first if it's missing or stale"""
+
+    manifest = read_manifest(cache_dir)
+    if manifest is None or not fresh(manifest, raw_dir, cache_dir):
+        manifest = build(cache_dir, raw_dir)
+    return Dataset(cache_dir, manifest)
+
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == VERSION else None
+
+
+def fresh(manifest, raw_dir, cache_dir):
+    """
+    Returns True if the raw CSVs are the ones the cache was built from. A file
+    that was touched but not changed gets its new modification time recorded,
+    so it isn't hashed again on every load.
+    """
+
+    files = raw_files(raw_dir)
+    if sorted(manifest["files"]) != sorted(os.path.basename(path) for path in files.values()):
+        return False
+
+    touched = False
+    for path in files.values():
+        recorded = manifest["files"][os.path.basename(path)]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        # only hash a file again if it looks like it might have changed
+        if stat.st_size == recorded["size"] and stat.st_mtime_ns == recorded["mtime_ns"]:
+            continue
+        if stat.st_size != recorded["size"] or sha256(path) != recorded["sha256"]:
+            return False
+        recorded["mtime_ns"] = stat.st_mtime_ns
+        touched = True
+
+    if touched:
+        write_manifest(cache_dir, manifest)
+    return True
+
+
+def save(directory, name, array):
+    """Writes an array as name.npy without ever leaving a partial file behind"""
+
+    tmp = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+    np.save(tmp, array)
+    os.replace(tmp, os.path.join(directory, name + ".npy"))
+
+
+def build(cache_dir=CACHE_DIR, raw_dir=RAW_DIR):
+    """Parses the raw CSVs into the cache and returns its manifest"""
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # one typed parse per decade, in the notebook's order
+    dtypes = {**{name: "float32" for name in FLOAT32}, **{name: "int8" for name in INT8}}
+    frames = []
+    files = {}
+    for decade, path in raw_files(raw_dir).items():
+        frame = pd.read_csv(path, dtype=dtypes)
+        frame["decade"] = np.int16(decade)
+        frames.append(frame)
+
+        stat = os.stat(path)
+        files[os.path.basename(path)] = {"sha256": sha256(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    df = pd.concat(frames, ignore_index=True)
+
+    for name in FLOAT32 + INT8 + ["decade"]:
+        save(cache_dir, name, df[name].to_numpy())
+
+    # dictionary encoding: each distinct string stored once, rows hold its int32 position
+    for name in STRINGS:
+        codes, values = pd.factorize(df[name].fillna(""))
+        encoded = [value.encode() for value in values]
+        save(cache_dir, name + ".codes", codes.astype(np.int32))
+        save(cache_dir, name + ".blob", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        save(cache_dir, name + ".offsets", np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64))
+
+    # the notebook's train_test_split(df, train_size=0.8, random_state=109), as row indices
+    from sklearn.model_selection import train_test_split
+    train, test = train_test_split(np.arange(len(df)), train_size=TRAIN_SIZE, random_state=RANDOM_STATE)
+    save(cache_dir, "train", train.astype(np.int32))
+    save(cache_dir, "test", test.astype(np.int32))
+
+    # written last, so a cache is only used once all of its files are in place
+    checksum = hashlib.sha256(json.dumps([VERSION, sorted((name, f["sha256"]) for name, f in files.items())]).encode())
+    manifest = {"version": VERSION, "rows": len(df), "files": files, "checksum": checksum.hexdigest(),
+                "split": {"train_size": TRAIN_SIZE, "random_state": RANDOM_STATE}}
+    write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def write_manifest(cache_dir, manifest):
+    tmp = os.path.join(cache_dir, f"manifest.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(cache_dir, "manifest.json"))
@@ -0,0 +1,186 @@
+"""
+Parallel, cached depth search for the hit classifier.
+
+The notebook picks each decision tree's depth by fitting depths 1-20 and
+running 5-fold cross validation, once on all decades and again for every
+decade. Here the whole (subset x depth x fold) grid goes to a process pool,
+and each fit's score is memoized on disk. The memo is keyed by the data's
+checksum and the fit's parameters, so re-running only fits what changed.
+
+    from selection import select, final_tree
+    results = select()                      # {"all": {...}, 1960: {...}, ...}
+    tree = final_tree("all", results["all"]["best_depth"])
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from loader import CACHE_DIR, DECADES, NUMERIC_PREDS, load
+
+MEMO_DIR = os.path.join(CACHE_DIR, "selection")
+
+DEPTHS = list(range(1, 21))
+FOLDS = 5
+RANDOM_STATE = 109
+
+# "all" uses every decade; the per-decade models drop the decade column, as in the notebook
+SUBSETS = ["all"] + list(DECADES)
+
+
+def features(subset):
+    return NUMERIC_PREDS if subset == "all" else [name for name in NUMERIC_PREDS if name != "decade"]
+
+
+def subset_rows(data, subset):
+    """Returns the training rows of a subset, in training set order"""
+
+    if subset == "all":
+        return np.asarray(data.train)
+    return np.asarray(data.train)[np.asarray(data.columns["decade"])[data.train] == subset]
+
+
+def fold_indices(data, subset, folds=FOLDS):
+    """The (train, validation) positions cross_val_score(cv=folds) would use: StratifiedKFold without shuffling"""
+
+    from sklearn.model_selection import StratifiedKFold
+
+    y = data.target(subset_rows(data, subset))
+    return list(StratifiedKFold(folds).split(np.zeros(len(y)), y))
+
+
+def memo_key(checksum, subset, depth, fold):
+    import sklearn
+
+    params = [checksum, str(subset), depth, fold, FOLDS, RANDOM_STATE, features(subset), sklearn.__version__]
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+
+def read_memo(key):
+    try:
+        with open(os.path.join(MEMO_DIR, key + ".json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_memo(key, result):
+    os.makedirs(MEMO_DIR, exist_ok=True)
+    tmp = os.path.join(MEMO_DIR, f"{key}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(result, f)
+    os.replace(tmp, os.path.join(MEMO_DIR, key + ".json"))
+
+
+# Worker state: every process memory-maps the same cache, so the data's pages are shared
+
+data = None
+
+
+def start_worker():
+    global data
+    data = load()
+
+
+@lru_cache(maxsize=None)
+def matrices(subset):
+    """
+    The subset's float32 feature matrix and targets, built once per process.
+    float32 is what the tree fits on internally, so no fit has to convert its
+    input. Each fold then only has to take its rows.
+    """
+
+    rows = subset_rows(data, subset)
+    return data.matrix(features(subset), rows), data.target(rows)
+
+
+def fit(task):
+    """
+    Fits one tree and returns the accuracy that gets memoized: on the
+    validation fold for a fold, or on the whole subset when fold is None.
+    """
+
+    from sklearn.tree import DecisionTreeClassifier
+
+    subset, depth, fold, train, validation = task
+    X, y = matrices(subset)
+    tree = DecisionTreeClassifier(max_depth=depth, random_state=RANDOM_STATE)
+    if fold is None:
+        tree.fit(X, y)
+        return {"score": tree.score(X, y)}
+    tree.fit(X[train], y[train])
+    return {"score": tree.score(X[validation], y[validation])}
+
+
+def select(subsets=SUBSETS, depths=DEPTHS, workers=None):
+    """
+    Runs the depth search for each subset and returns, per subset, the lists
+    the notebook builds: depths, train_scores, cvmeans and cvstds, plus best_depth.
+    Only fits missing from the memo are run, spread over `workers` processes
+    (every core by default).
+    """
+
+    global data
+    data = load()
+
+    # every (subset, depth, fold) the results need; fold None is the fit on the whole subset
+    scores = {}
+    tasks = []
+    for subset in subsets:
+        folds = fold_indices(data, subset)
+        for depth in depths:
+            for fold in [None] + list(range(FOLDS)):
+                key = memo_key(data.checksum, subset, depth, fold)
+                result = read_memo(key)
+                if result is not None:
+                    scores[subset, depth, fold] = result["score"]
+                elif fold is None:
+                    tasks.append((key, (subset, depth, None, None, None)))
+                else:
+                    tasks.append((key, (subset, depth, fold) + folds[fold]))
+
+    if tasks:
+        with ProcessPoolExecutor(workers or os.cpu_count(), initializer=start_worker) as pool:
+            # bigger chunks mean fewer round trips; the fold indices are the only sizeable part of a task
+            for (key, task), result in zip(tasks, pool.map(fit, [task for _, task in tasks], chunksize=4)):
+                write_memo(key, result)
+                scores[task[:3]] = result["score"]
+
+    results = {}
+    for subset in subsets:
+        cv = [[scores[subset, depth, fold] for fold in range(FOLDS)] for depth in depths]
+        cvmeans = [float(np.mean(fold_scores)) for fold_scores in cv]
+        results[subset] = {
+            "depths": list(depths),
+            "train_scores": [scores[subset, depth, None] for depth in depths],
+            "cvmeans": cvmeans,
+            "cvstds": [float(np.std(fold_scores)) for fold_scores in cv],
+            "best_depth": depths[int(np.argmax(cvmeans))],
+        }
+    return results
+
+
+def final_tree(subset, depth):
+    """Fits the subset's tree at the chosen depth on all of its training rows"""
+
+    from sklearn.tree import DecisionTreeClassifier
+
+    data = load()
+    rows = subset_rows(data, subset)
+    return DecisionTreeClassifier(max_depth=depth, random_state=RANDOM_STATE).fit(data.matrix(features(subset), rows),
+                                                                                 data.target(rows))
+
+
+def permutation_importances(tree, subset, n_jobs=-1):
+    """The notebook's permutation_importance on the training rows, with the repeats spread over every core"""
+
+    from sklearn.inspection import permutation_importance
+
+    data = load()
+    rows = subset_rows(data, subset)
+    result = permutation_importance(tree, data.matrix(features(subset), rows), data.target(rows),
+                                    random_state=RANDOM_STATE, n_jobs=n_jobs)
+    return dict(zip(features(subset), result["importances_mean"]))
@@ -0,0 +1,150 @@
+"""
+Streaming tokenize-and-encode pipeline for the Yelp reviews.
+
+Does what the notebook's cleaning cells do (clean, vocabulary, encode,
+pad_sequences(X, 256)) without ever holding the whole corpus in memory:
+
+  1. the review CSVs are read in chunks and each chunk is tokenized in a
+     process pool, which counts the words; the counts are merged into the vocabulary
+  2. the CSVs are read again and each chunk is encoded and padded/truncated in
+     the pool, and the resulting rows are written straight into a preallocated
+     memory-mapped int32 array
+
+Peak memory is a few chunks per worker plus the vocabulary, and both passes
+spread across every core. From the yelp_reviews directory:
+
+    python pipeline.py --data data
+
+writes data/reviews_X.npy (int32, rows x 256), data/reviews_y.npy (stars) and
+the vocabulary to data/vocab (see vocabulary.py). Load the arrays with
+np.load(..., mmap_mode="r") and the vocabulary with Vocabulary("data/vocab").
+"""
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from vocabulary import Vocabulary
+
+MAX_WORDS = 256
+CHUNKSIZE = 20000
+
+# nltk's wordpunct_tokenize: runs of word characters, or runs of punctuation
+TOKEN = re.compile(r"\w+|[^\w\s]+")
+
+
+def clean(string):
+    """The notebook's clean(): lowercase, then wordpunct_tokenize"""
+
+    return TOKEN.findall(string.lower())
+
+
+def review_files(data_dir):
+    return [os.path.join(data_dir, f"review{i}.csv") for i in range(1, 8)]
+
+
+def chunks(files, chunksize=CHUNKSIZE):
+    """Yields (texts, stars) for every chunk of every file, in order"""
+
+    for path in files:
+        for chunk in pd.read_csv(path, usecols=["text", "stars"], chunksize=chunksize):
+            yield chunk["text"].fillna("").tolist(), chunk["stars"].to_numpy()
+
+
+def bounded_map(pool, function, items, window):
+    """
+    Like pool.map, yielding results in order, but with at most `window` tasks
+    submitted at a time, so the input isn't read faster than it's consumed.
+    """
+
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def count_chunk(texts):
+    """Pass 1: the number of reviews in a chunk and how often each token occurs in it"""
+
+    counts = Counter()
+    for text in texts:
+        counts.update(clean(text))
+    return len(texts), counts
+
+
+# Pass 2 workers memory-map the vocabulary when they start, sharing its pages
+vocabulary = None
+
+
+def start_encoder(path):
+    global vocabulary
+    vocabulary = Vocabulary(path)
+
+
+def encode_chunk(texts, stars, max_words=MAX_WORDS):
+    """
+    Pass 2: encodes a chunk into rows of max_words ids, matching
+    pad_sequences' defaults: long reviews keep their last max_words tokens,
+    short ones are padded with 0 at the front. Words not in the vocabulary
+    (pruned by min_count) are dropped.
+    """
+
+    return vocabulary.encode_batch([clean(text) for text in texts], max_words), stars
+
+
+def run(data_dir, out_dir=None, chunksize=CHUNKSIZE, workers=None, max_words=MAX_WORDS, min_count=1):
+    """Runs both passes and returns (X, y, vocabulary), with X and y memory-mapped from out_dir"""
+
+    out_dir = out_dir or data_dir
+    files = review_files(data_dir)
+    workers = workers or os.cpu_count()
+    window = 2 * workers
+
+    # pass 1: count rows and words
+    rows = 0
+    counts = Counter()
+    with ProcessPoolExecutor(workers) as pool:
+        count = ((texts,) for texts, _ in chunks(files, chunksize))
+        for n, chunk_counts in bounded_map(pool, count_chunk, count, window):
+            rows += n
+            counts.update(chunk_counts)
+
+    path = os.path.join(out_dir, "vocab")
+    vocabulary = Vocabulary.build(path, counts, min_count)
+
+    # pass 2: encode straight into the output arrays
+    X = np.lib.format.open_memmap(os.path.join(out_dir, "reviews_X.npy"), mode="w+", dtype=np.int32,
+                                  shape=(rows, max_words))
+    y = np.lib.format.open_memmap(os.path.join(out_dir, "reviews_y.npy"), mode="w+", dtype=np.int8, shape=(rows,))
+    start = 0
+    with ProcessPoolExecutor(workers, initializer=start_encoder, initargs=(path,)) as pool:
+        encode = ((texts, stars, max_words) for texts, stars in chunks(files, chunksize))
+        for block, stars in bounded_map(pool, encode_chunk, encode, window):
+            X[start:start + len(block)] = block
+            y[start:start + len(block)] = stars
+            start += len(block)
+    X.flush()
+    y.flush()
+
+    return X, y, vocabulary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize and encode the Yelp reviews")
+    parser.add_argument("--data", default="data", help="directory with review1.csv ... review7.csv")
+    parser.add_argument("--out", help="where to write the arrays and vocabulary (default: --data)")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-words", type=int, default=MAX_WORDS)
+    parser.add_argument("--min-count", type=int, default=1, help="leave out words seen fewer times")
+    args = parser.parse_args()
+
+    X, y, vocabulary = run(args.data, args.out, args.chunksize, args.workers, args.max_words, args.min_count)
+    print(f"encoded {len(X)} reviews with a vocabulary of {len(vocabulary) - 1} words")
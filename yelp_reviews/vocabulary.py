@@ -0,0 +1,184 @@
+"""
+Compact, memory-mapped vocabulary for the Yelp reviews (replaces word2idx.pkl).
+
+A vocabulary is a directory of .npy files:
+  blob, offsets   every word's UTF-8 bytes, concatenated in sorted byte order
+  prefixes        each sorted word's first 16 bytes, as fixed-width bytes for searchsorted
+  ids             the id of each sorted word
+  positions       the sorted position of each id, for decoding
+  counts          how often each id's word occurred when the vocabulary was built
+
+Ids are assigned most frequent first, starting at 1; 0 is <PAD>. So pruning
+rare words keeps a prefix of the ids, and ids of the words kept don't change.
+
+Everything is memory-mapped read-only, so loading takes no time and every
+process using the same vocabulary shares one copy of it.
+
+    vocab = Vocabulary("data/vocab")
+    X = vocab.encode_batch([clean(text) for text in texts], max_words=256)
+    vocab.decode(X[0])
+"""
+import json
+import os
+
+import numpy as np
+
+PAD = "<PAD>"
+UNKNOWN = -1
+
+# Bytes of each word compared by searchsorted; only longer tokens need a Python binary search
+PREFIX = 16
+
+
+def prefix_keys(encoded):
+    """The first PREFIX bytes of each bytes object, as a fixed-width bytes array (which sorts like the bytes)"""
+
+    return np.array(encoded, dtype=f"S{PREFIX}")
+
+
+class Vocabulary:
+    """A vocabulary directory written by Vocabulary.build(), memory-mapped"""
+
+    def __init__(self, path):
+        self.path = path
+
+        def array(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self.blob = array("blob")
+        self.offsets = array("offsets")
+        self.prefixes = array("prefixes")
+        self.ids = array("ids")
+        self.positions = array("positions")
+        self.counts = array("counts")
+
+        # zero-copy view of the blob for slicing out single words
+        self.view = memoryview(self.blob)
+
+    def __len__(self):
+        """The number of ids, including 0 for <PAD>"""
+
+        return len(self.ids)
+
+    def word_bytes(self, position):
+        return bytes(self.view[self.offsets[position]:self.offsets[position + 1]])
+
+    def encode(self, tokens):
+        """Returns the int32 ids of a list of tokens, UNKNOWN (-1) for tokens not in the vocabulary"""
+
+        # text repeats itself a lot, so each distinct token is only looked up once per batch
+        distinct = list(dict.fromkeys(tokens))
+        ids = dict(zip(distinct, self.lookup(distinct).tolist()))
+        return np.fromiter(map(ids.__getitem__, tokens), dtype=np.int32, count=len(tokens))
+
+    def lookup(self, tokens):
+        """encode() without the deduplication: one binary search per token"""
+
+        if not tokens:
+            return np.zeros(0, dtype=np.int32)
+
+        encoded = [token.encode() for token in tokens]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+
+        # the sorted words sharing each token's first PREFIX bytes are positions lo to hi - 1
+        keys = prefix_keys(encoded)
+        lo = np.searchsorted(self.prefixes, keys, "left")
+        hi = np.searchsorted(self.prefixes, keys, "right")
+
+        # a token of PREFIX bytes or fewer is a prefix of every other word in its range,
+        # so it sorts first: it's in the vocabulary if the first word has its length
+        first = np.minimum(lo, len(self.ids) - 1)
+        short = lengths <= PREFIX
+        found = short & (lo < hi) & (self.offsets[first + 1] - self.offsets[first] == lengths)
+        ids = np.where(found, self.ids[first], UNKNOWN).astype(np.int32)
+
+        # longer tokens are binary searched within their (narrow) range
+        for i in np.flatnonzero(~short & (lo < hi)):
+            token, low, high = encoded[i], lo[i], hi[i]
+            while low < high:
+                middle = (low + high) // 2
+                if self.word_bytes(middle) < token:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < hi[i] and self.word_bytes(low) == token:
+                ids[i] = self.ids[low]
+        return ids
+
+    def decode(self, ids, skip_pad=True):
+        """Returns the words of an array of ids (leaving out <PAD> unless skip_pad is False)"""
+
+        ids = np.asarray(ids)
+        if skip_pad:
+            ids = ids[ids != 0]
+        positions = self.positions[ids]
+        starts, ends = self.offsets[positions].tolist(), self.offsets[positions + 1].tolist()
+        return [str(self.view[start:end], "utf-8") for start, end in zip(starts, ends)]
+
+    def encode_batch(self, documents, max_words=256):
+        """
+        Encodes lists of tokens into a (documents x max_words) int32 matrix the
+        way pad_sequences does by default: each row keeps its last max_words
+        known tokens, padded with 0 at the front. Tokens not in the vocabulary are dropped.
+        """
+
+        rows = np.zeros((len(documents), max_words), dtype=np.int32)
+        lengths = np.fromiter(map(len, documents), dtype=np.int64, count=len(documents))
+        ids = self.encode([token for document in documents for token in document])
+
+        # which document each known token belongs to, and how far it is from that document's end
+        document = np.repeat(np.arange(len(documents)), lengths)
+        known = ids != UNKNOWN
+        ids, document = ids[known], document[known]
+        ends = np.cumsum(np.bincount(document, minlength=len(documents)))
+        from_end = ends[document] - 1 - np.arange(len(ids))
+
+        keep = from_end < max_words
+        rows[document[keep], max_words - 1 - from_end[keep]] = ids[keep]
+        return rows
+
+    def prune(self, path, min_count=1, max_size=None):
+        """Writes a vocabulary of the words seen at least min_count times (at most max_size of them) to path"""
+
+        keep = int(np.count_nonzero(np.asarray(self.counts[1:]) >= min_count))
+        if max_size is not None:
+            keep = min(keep, max_size)
+        words = self.decode(np.arange(1, keep + 1))
+        return Vocabulary.build(path, dict(zip(words, np.asarray(self.counts[1:keep + 1]).tolist())))
+
+    @staticmethod
+    def build(path, counts, min_count=1):
+        """
+        Writes the vocabulary of a {word: count} mapping (such as a Counter) to
+        path, keeping the words seen at least min_count times, and returns it loaded.
+        """
+
+        words = sorted((word for word, count in counts.items() if count >= min_count), key=lambda word: (-counts[word], word))
+        words = [PAD] + words
+        encoded = [word.encode() for word in words]
+
+        # sorted byte order, which is also the order of the fixed-width prefixes
+        order = sorted(range(len(words)), key=encoded.__getitem__)
+        blob = b"".join(encoded[i] for i in order)
+        offsets = np.cumsum([0] + [len(encoded[i]) for i in order], dtype=np.int64)
+        positions = np.empty(len(words), dtype=np.int32)
+        positions[order] = np.arange(len(words), dtype=np.int32)
+
+        arrays = {
+            "blob": np.frombuffer(blob, dtype=np.uint8),
+            "offsets": offsets,
+            "prefixes": prefix_keys([encoded[i] for i in order]),
+            "ids": np.array(order, dtype=np.int32),
+            "positions": positions,
+            "counts": np.array([0] + [counts[word] for word in words[1:]], dtype=np.int64),
+        }
+
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            tmp = os.path.join(path, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmp, array)
+            os.replace(tmp, os.path.join(path, name + ".npy"))
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump({"words": len(words) - 1, "min_count": min_count}, f)
+
+        return Vocabulary(path)